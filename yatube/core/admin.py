@@ -0,0 +1,46 @@
+from django.contrib import admin
+
+from .models import OutboxMessage, Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'name',
+        'key',
+        'priority',
+        'run_at',
+        'attempts',
+        'failed'
+    )
+    list_filter = ('failed', 'name')
+    search_fields = ('name', 'key')
+    actions = ('retry',)
+
+    def retry(self, request, queryset):
+        queryset.update(failed=False, attempts=0, locked_until=None)
+    retry.short_description = 'Поставить снова'
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'subject',
+        'recipients',
+        'run_at',
+        'attempts',
+        'failed'
+    )
+    list_filter = ('failed',)
+    search_fields = ('subject', 'recipients')
+    exclude = ('payload',)
+    actions = ('retry',)
+
+    def retry(self, request, queryset):
+        queryset.update(failed=False, attempts=0, locked_by='',
+                        locked_until=None)
+    retry.short_description = 'Отправить снова'
+
+
+admin.site.register(Task, TaskAdmin)
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
@@ -0,0 +1,126 @@
+import contextlib
+import copy
+import logging
+import pickle
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import tasks
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxBackend(BaseEmailBackend):
+    """Почтовый бэкенд, который не отправляет письма, а складывает их
+    в OutboxMessage и ставит задачу доставки.
+
+    Медленный SMTP-сервер больше не держит поток запроса: send_mail
+    стоит одного INSERT.
+    """
+
+    def send_messages(self, email_messages):
+        rows = []
+        for message in email_messages:
+            if not message.recipients():
+                continue
+            message = copy.copy(message)
+            # Соединение не сериализуется и при доставке будет своё.
+            message.connection = None
+            rows.append(OutboxMessage(
+                subject=message.subject[:255],
+                recipients=', '.join(message.recipients()),
+                payload=pickle.dumps(message),
+            ))
+        OutboxMessage.objects.bulk_create(rows)
+        if rows:
+            tasks.enqueue(deliver, priority=tasks.PRIORITY_HIGH)
+        return len(rows)
+
+
+def ready():
+    now = timezone.now()
+    return OutboxMessage.objects.filter(failed=False, run_at__lte=now).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    )
+
+
+def claim(limit):
+    """Занимает порцию готовых писем одним UPDATE и возвращает её."""
+    token = uuid.uuid4().hex
+    pks = list(ready().values_list('pk', flat=True)[:limit])
+    ready().filter(pk__in=pks).update(
+        locked_by=token,
+        locked_until=timezone.now() + timedelta(
+            seconds=settings.TASK_LOCK_TIMEOUT
+        ),
+        attempts=F('attempts') + 1,
+    )
+    return list(OutboxMessage.objects.filter(locked_by=token))
+
+
+def retry(message, error):
+    """Откладывает письмо до повтора и ставит отложенную задачу
+    доставки, которая его отправит. После OUTBOX_MAX_ATTEMPTS попыток
+    письмо помечается failed."""
+    message.last_error = error
+    message.locked_by = ''
+    message.locked_until = None
+    delay = settings.OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1)
+    if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        message.failed = True
+    else:
+        message.run_at = timezone.now() + timedelta(seconds=delay)
+    message.save(update_fields=['last_error', 'locked_by', 'locked_until',
+                                'failed', 'run_at'])
+    if not message.failed:
+        tasks.enqueue(deliver, key=f'outbox:{message.pk}',
+                      priority=tasks.PRIORITY_HIGH, delay=delay)
+
+
+def deliver(batch_size=None):
+    """Отправляет готовые письма порциями через OUTBOX_EMAIL_BACKEND.
+
+    Соединение открывается один раз на весь проход и переоткрывается
+    только после ошибки. Письмо, которое не ушло, ждёт повтора,
+    остальные отправляются дальше. Возвращает (отправлено, с ошибкой).
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    sent = failed = 0
+    connection = None
+    try:
+        while True:
+            messages = claim(batch_size)
+            if not messages:
+                break
+            for message in messages:
+                try:
+                    if connection is None:
+                        connection = get_connection(
+                            settings.OUTBOX_EMAIL_BACKEND
+                        )
+                        connection.open()
+                    connection.send_messages([pickle.loads(message.payload)])
+                except Exception:
+                    logger.exception('Не удалось отправить письмо %s',
+                                     message.pk)
+                    retry(message, traceback.format_exc())
+                    failed += 1
+                    if connection is not None:
+                        with contextlib.suppress(Exception):
+                            connection.close()
+                    connection = None
+                    continue
+                message.delete()
+                sent += 1
+    finally:
+        if connection is not None:
+            connection.close()
+    return sent, failed
@@ -0,0 +1,98 @@
+import multiprocessing
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'filebased': 'django.core.cache.backends.filebased.FileBasedCache',
+    'sqlite': 'core.cache.SQLiteCache',
+}
+
+
+def make_cache(name, directory):
+    location = {
+        'locmem': 'bench',
+        'filebased': f'{directory}/filebased',
+        'sqlite': f'{directory}/cache.sqlite3',
+    }[name]
+    options = {'MAX_ENTRIES': 100000}
+    return import_string(BACKENDS[name])(location, {'OPTIONS': options})
+
+
+def worker(name, directory, worker_id, processes, operations, keys, queue):
+    """Смешанная нагрузка: 80% чтений, 15% записей, 5% incr.
+
+    Каждый процесс пишет только свои ключи, а читает все, поэтому
+    доля попаданий показывает, видят ли процессы записи друг друга.
+    """
+    cache = make_cache(name, directory)
+    rnd = random.Random(worker_id)
+    hits = reads = 0
+    started = time.perf_counter()
+    for i in range(operations):
+        dice = rnd.random()
+        if dice < 0.80:
+            reads += 1
+            hits += cache.get(f'key:{rnd.randrange(keys)}') is not None
+        elif dice < 0.95:
+            key = rnd.randrange(worker_id, keys, processes)
+            cache.set(f'key:{key}', 'x' * 512, 300)
+        else:
+            try:
+                cache.incr('counter')
+            except ValueError:
+                cache.add('counter', 0)
+    queue.put((time.perf_counter() - started, hits, reads))
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает кэш-бэкенды под нагрузкой нескольких процессов: '
+            'пропускную способность и долю попаданий.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, nargs='+',
+                            default=[1, 2, 4, 8])
+        parser.add_argument('--operations', type=int, default=5000,
+                            help='Операций на процесс.')
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--backends', nargs='+', default=list(BACKENDS),
+                            choices=list(BACKENDS))
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"бэкенд":<10} {"процессы":>8} {"оп/с":>10} {"попадания":>10}'
+        )
+        for name in options['backends']:
+            for processes in options['processes']:
+                throughput, hit_rate = self.run(name, processes, options)
+                self.stdout.write(
+                    f'{name:<10} {processes:>8} {throughput:>10.0f} '
+                    f'{hit_rate:>9.1%}'
+                )
+
+    def run(self, name, processes, options):
+        with tempfile.TemporaryDirectory() as directory:
+            queue = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(
+                    target=worker,
+                    args=(name, directory, worker_id, processes,
+                          options['operations'], options['keys'], queue)
+                )
+                for worker_id in range(processes)
+            ]
+            started = time.perf_counter()
+            for process in workers:
+                process.start()
+            results = [queue.get() for _ in workers]
+            for process in workers:
+                process.join()
+            elapsed = time.perf_counter() - started
+        hits = sum(result[1] for result in results)
+        reads = sum(result[2] for result in results)
+        total = processes * options['operations']
+        return total / elapsed, hits / max(reads, 1)
@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import tasks
+
+
+def execute(pk):
+    try:
+        return tasks.execute(pk)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди core.Task: повторы после '
+            'ошибок, задачи упавших процессов и всё остальное, если '
+            'TASK_RUN_LOCALLY выключен.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=max(settings.TASK_WORKERS, 1),
+            help='Сколько задач выполнять одновременно.'
+        )
+        parser.add_argument(
+            '--processes', action='store_true',
+            help='Выполнять задачи в пуле процессов, а не потоков: '
+                 'для задач, которые упираются в процессор.'
+        )
+        parser.add_argument(
+            '--poll', type=float, default=1,
+            help='Через сколько секунд снова смотреть в пустую очередь.'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Выйти, когда готовых задач не останется.'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['processes']:
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers,
+                                          thread_name_prefix='tasks')
+        done = failed = 0
+        with executor:
+            while True:
+                # Задачи занимает только этот поток, пул их выполняет.
+                pks = tasks.claim(workers)
+                if not pks:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                # Дочерние процессы не должны унаследовать соединение.
+                connections.close_all()
+                for result in executor.map(execute, pks):
+                    done += result
+                    failed += not result
+                self.stdout.write(f'Выполнено задач: {done}, '
+                                  f'с ошибкой: {failed}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Очередь пуста: выполнено {done}, с ошибкой {failed}'
+        ))
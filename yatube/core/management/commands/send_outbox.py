@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import mail
+
+
+class Command(BaseCommand):
+    help = ('Отправляет письма из core.OutboxMessage порциями через '
+            'OUTBOX_EMAIL_BACKEND, по одному соединению на проход.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Сколько писем занимать за раз. По умолчанию '
+                 'OUTBOX_BATCH_SIZE.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Не выходить, а проверять очередь снова каждые '
+                 '--poll секунд.'
+        )
+        parser.add_argument('--poll', type=float, default=5)
+
+    def handle(self, *args, **options):
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = mail.deliver(options['batch_size'])
+            sent += batch_sent
+            failed += batch_failed
+            if batch_sent or batch_failed:
+                self.stdout.write(f'Отправлено писем: {sent}, '
+                                  f'с ошибкой: {failed}')
+            if not options['loop']:
+                break
+            time.sleep(options['poll'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Отправлено {sent}, отложено до повтора {failed}'
+        ))
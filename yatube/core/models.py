@@ -0,0 +1,65 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """Отложенный вызов функции из очереди core.tasks.
+
+    Выполненные задачи удаляются, в таблице остаются ожидающие
+    и те, что исчерпали попытки.
+    """
+    name = models.CharField('Функция', max_length=200)
+    payload = models.TextField('Аргументы', default='{}')
+    # Задача с тем же name и key, пока она ждёт, повторно не ставится.
+    key = models.CharField('Ключ', max_length=200, blank=True)
+    priority = models.SmallIntegerField('Приоритет', default=0)
+    run_at = models.DateTimeField('Выполнить не раньше', default=timezone.now)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField('Попыток максимум',
+                                                    default=3)
+    locked_until = models.DateTimeField('Выполняется до', blank=True,
+                                        null=True)
+    failed = models.BooleanField('Не выполнена', default=False)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+
+    class Meta:
+        ordering = ['-priority', 'run_at']
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['failed', '-priority', 'run_at'],
+                         name='task_queue_idx'),
+            models.Index(fields=['name', 'key'], name='task_key_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}({self.key})' if self.key else self.name
+
+
+class OutboxMessage(models.Model):
+    """Письмо, ожидающее отправки через core.mail.deliver."""
+    subject = models.CharField('Тема', max_length=255, blank=True)
+    recipients = models.TextField('Получатели')
+    # EmailMessage целиком, с вложениями и альтернативами.
+    payload = models.BinaryField('Письмо')
+    run_at = models.DateTimeField('Отправить не раньше', default=timezone.now)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    locked_by = models.CharField('Отправитель', max_length=32, blank=True)
+    locked_until = models.DateTimeField('Отправляется до', blank=True,
+                                        null=True)
+    failed = models.BooleanField('Не отправлено', default=False)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created = models.DateTimeField('Создано', auto_now_add=True)
+
+    class Meta:
+        ordering = ['run_at']
+        verbose_name = 'Письмо в очереди'
+        verbose_name_plural = 'Письма в очереди'
+        indexes = [
+            models.Index(fields=['failed', 'run_at'], name='outbox_queue_idx'),
+            models.Index(fields=['locked_by'], name='outbox_locked_by_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {self.recipients}'
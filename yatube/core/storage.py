@@ -0,0 +1,62 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# dir/ab/cd/<sha256>.ext - имя, выведенное из содержимого файла.
+# Так же, по хешу, sorl-thumbnail раскладывает миниатюры в cache/.
+HASHED_NAME_RE = re.compile(
+    r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32,64}(@[\d.]+x)?\.\w+$'
+)
+
+
+def file_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """Хранилище, которое называет файлы по SHA-256 содержимого.
+
+    posts/photo.jpg сохраняется как posts/ab/cd/abcd...ef.jpg: файлы
+    расходятся по подкаталогам, одинаковые загрузки хранятся одним
+    файлом, а содержимое по имени никогда не меняется, поэтому его
+    можно кэшировать навсегда.
+    """
+
+    def hashed_name(self, name, content):
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = file_hash(content)
+        return posixpath.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        )
+
+    @staticmethod
+    def is_hashed_name(name):
+        return HASHED_NAME_RE.search(name) is not None
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        try:
+            # Повторная загрузка: файл свежий, как только что сохранённый,
+            # и gc_media с --min-age не удалит его до записи поста.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+        else:
+            return name
+        # Если такой же файл параллельно сохраняет другой запрос,
+        # FileSystemStorage добавит к имени суффикс - копия лишняя,
+        # но корректная.
+        return super().save(name, content, max_length=max_length)
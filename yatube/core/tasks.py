@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 10
+PRIORITY_DEFAULT = 0
+PRIORITY_LOW = -10
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+# Места в очереди пула процесса; без свободного места задача остаётся
+# в таблице и её выполнит run_tasks.
+_slots = None
+
+
+def enqueue(func, *args, key='', priority=PRIORITY_DEFAULT, delay=0,
+            max_attempts=None, **kwargs):
+    """Ставит вызов func(*args, **kwargs) в очередь.
+
+    Строка задачи пишется в текущей транзакции и становится видна
+    вместе с данными, ради которых задача поставлена. Аргументы должны
+    сериализоваться в JSON. Если задача с тем же key ещё ждёт,
+    новая не ставится и возвращается None. Уже выполняющаяся задача
+    не в счёт: изменения, ради которых ставят новую, она могла не увидеть.
+    """
+    name = f'{func.__module__}.{func.__qualname__}'
+    if key and Task.objects.filter(name=name, key=key, failed=False).exclude(
+        locked_until__gt=timezone.now()
+    ).exists():
+        return None
+    task = Task.objects.create(
+        name=name,
+        payload=json.dumps({'args': args, 'kwargs': kwargs}),
+        key=key,
+        priority=priority,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+    )
+    if settings.TASK_RUN_LOCALLY and not delay:
+        transaction.on_commit(lambda: submit(task.pk))
+    return task
+
+
+def ready():
+    now = timezone.now()
+    return Task.objects.filter(failed=False, run_at__lte=now).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    )
+
+
+def claim(limit=1, pks=None):
+    """Занимает до limit готовых задач и возвращает их pk.
+
+    Задачу занимает один UPDATE по условию готовности, поэтому её
+    не возьмут два воркера сразу. Если воркер упал, задача снова
+    станет готовой, когда истечёт TASK_LOCK_TIMEOUT.
+    """
+    candidates = ready().order_by('-priority', 'run_at')
+    if pks is not None:
+        candidates = candidates.filter(pk__in=pks)
+    claimed = []
+    for pk in candidates.values_list('pk', flat=True)[:limit]:
+        locked_until = timezone.now() + timedelta(
+            seconds=settings.TASK_LOCK_TIMEOUT
+        )
+        # Попытка засчитывается при захвате: задача, которая роняет
+        # воркер, тоже когда-нибудь исчерпает попытки.
+        if ready().filter(pk=pk).update(locked_until=locked_until,
+                                        attempts=F('attempts') + 1):
+            claimed.append(pk)
+    return claimed
+
+
+def execute(pk):
+    """Выполняет занятую задачу. Возвращает True, если она выполнена."""
+    task = Task.objects.filter(pk=pk).first()
+    if task is None:
+        return False
+    payload = json.loads(task.payload)
+    try:
+        import_string(task.name)(*payload['args'], **payload['kwargs'])
+    except Exception:
+        logger.exception('Задача %s завершилась ошибкой', task)
+        retry(task, traceback.format_exc())
+        return False
+    task.delete()
+    return True
+
+
+def retry(task, error):
+    task.last_error = error
+    task.locked_until = None
+    if task.attempts >= task.max_attempts:
+        task.failed = True
+    else:
+        # Пауза удваивается с каждой попыткой.
+        task.run_at = timezone.now() + timedelta(
+            seconds=settings.TASK_RETRY_DELAY * 2 ** (task.attempts - 1)
+        )
+    task.save(update_fields=['last_error', 'locked_until', 'failed',
+                             'run_at'])
+
+
+def run(pk):
+    """Занимает и выполняет задачу, если её ещё никто не взял."""
+    if claim(pks=[pk]):
+        return execute(pk)
+    return False
+
+
+def get_executor():
+    global _executor, _executor_pid, _slots
+    with _lock:
+        # После fork потоки пула родителя в дочернем процессе не живут.
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TASK_WORKERS,
+                thread_name_prefix='tasks',
+            )
+            _executor_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(
+                settings.TASK_WORKERS + settings.TASK_LOCAL_BACKLOG
+            )
+        return _executor, _slots
+
+
+def submit(pk):
+    """Отдаёт задачу пулу потоков процесса, а при TASK_WORKERS = 0
+    выполняет её сразу в текущем потоке.
+
+    Запрос выполнения не ждёт. Если пул уже занят и его очередь
+    заполнена, задача не копится в памяти процесса, а остаётся
+    готовой в таблице до run_tasks. Возвращает True, если задача
+    отдана пулу или выполнена.
+    """
+    if not settings.TASK_WORKERS:
+        run(pk)
+        return True
+    executor, slots = get_executor()
+    if not slots.acquire(blocking=False):
+        return False
+    executor.submit(_work, pk, slots)
+    return True
+
+
+def _work(pk, slots):
+    try:
+        run(pk)
+    finally:
+        slots.release()
+        connections.close_all()
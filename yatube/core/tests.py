@@ -0,0 +1,380 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.http import Http404
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.utils import timezone
+
+from . import cache as sqlite_cache
+from . import tasks
+from .cache import SQLiteCache
+from .mail import deliver
+from .models import OutboxMessage, Task
+from .storage import HashedFileSystemStorage
+from .views import media
+
+
+calls = []
+
+
+def remember(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+def flaky():
+    raise ValueError('Сбой')
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    opened = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+
+    def send_messages(self, messages):
+        if any('broken' in address for message in messages
+               for address in message.recipients()):
+            raise ConnectionError('Сервер не ответил')
+        return super().send_messages(messages)
+
+
+def increment(location, times):
+    cache = SQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location,
+                                 {'OPTIONS': {'MAX_ENTRIES': 10}})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_set_delete(self):
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertEqual(self.cache.get_many(['key', 'missing']),
+                         {'key': {'value': 1}})
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_timeout(self):
+        self.cache.set('key', 'value', timeout=1)
+        self.cache.set('forever', 'value', timeout=None)
+        self.assertFalse(self.cache.add('key', 'other'))
+        time.sleep(1.1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'other'))
+        self.assertEqual(self.cache.get('forever'), 'value')
+
+    def test_shared_between_instances(self):
+        """Запись одного экземпляра видна другому, как другому процессу"""
+
+        SQLiteCache(self.location, {}).set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('counter', 0)
+        processes = [
+            multiprocessing.Process(target=increment,
+                                    args=(self.location, 50))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_lru_eviction(self):
+        """При переполнении вытесняются давно не читавшиеся ключи"""
+
+        for i in range(10):
+            self.cache.set(f'key{i}', i)
+        self.cache.connection().execute(
+            'UPDATE cache SET accessed = accessed - 100')
+        self.cache.get('key0')
+        self.cache.local.writes = sqlite_cache.CULL_CHECK_EVERY
+        self.cache.set('key10', 10)
+        self.assertEqual(self.cache.get('key0'), 0)
+        self.assertEqual(self.cache.get('key10'), 10)
+        self.assertIsNone(self.cache.get('key1'))
+
+
+class HashedStorageTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = HashedFileSystemStorage(location=self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_names_by_content_and_deduplicates(self):
+        first = self.storage.save('posts/photo.JPG', ContentFile(b'photo'))
+        second = self.storage.save('posts/copy.jpg', ContentFile(b'photo'))
+        other = self.storage.save('posts/photo.jpg', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/'
+                                r'\1\2[0-9a-f]{60}\.jpg$')
+        self.assertTrue(self.storage.is_hashed_name(first))
+        self.assertFalse(self.storage.is_hashed_name('posts/photo.jpg'))
+        self.assertEqual(len(os.listdir(os.path.dirname(
+            self.storage.path(first)
+        ))), 1)
+
+    def test_media_view_marks_hashed_files_immutable(self):
+        name = self.storage.save('posts/photo.jpg', ContentFile(b'photo'))
+        with open(os.path.join(self.directory.name, 'plain.jpg'), 'wb') as f:
+            f.write(b'plain')
+        request = RequestFactory().get('/media/')
+        with override_settings(MEDIA_ROOT=self.directory.name):
+            hashed = media(request, name)
+            plain = media(request, 'plain.jpg')
+        self.assertIn('immutable', hashed['Cache-Control'])
+        self.assertIn('max-age=31536000', hashed['Cache-Control'])
+        self.assertFalse(plain.has_header('Cache-Control'))
+
+
+@override_settings(MEDIA_SENDFILE_HEADER=None)
+class MediaViewTest(SimpleTestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = HashedFileSystemStorage(location=self.directory.name)
+        self.name = self.storage.save('posts/photo.jpg',
+                                      ContentFile(self.content))
+        self.factory = RequestFactory()
+        media_root = override_settings(MEDIA_ROOT=self.directory.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get(self, path=None, **headers):
+        response = media(self.factory.get('/media/', **headers),
+                         path or self.name)
+        self.addCleanup(response.close)
+        return response
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response.has_header('Last-Modified'))
+        # Непрерывный хвост файла отдаётся самим файлом, через sendfile.
+        self.assertTrue(hasattr(response.file_to_stream, 'fileno'))
+
+    def test_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[10:20])
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+
+        response = self.get(HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[-24:])
+        self.assertEqual(response['Content-Range'], 'bytes 1000-1023/1024')
+
+        response = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[1000:])
+
+        response = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+        response = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_requests(self):
+        response = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304
+        )
+        ranged = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(ranged.status_code, 206)
+        changed = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(changed.status_code, 200)
+
+    def test_sendfile_header(self):
+        with override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect',
+                               MEDIA_ACCEL_PREFIX='/protected/'):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/protected/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        with override_settings(MEDIA_SENDFILE_HEADER='X-Sendfile'):
+            response = self.get()
+        self.assertEqual(response['X-Sendfile'],
+                         os.path.join(self.directory.name, self.name))
+
+    def test_missing_and_outside_files(self):
+        for path in ('posts/missing.jpg', '../secret', 'posts'):
+            with self.subTest(path=path), self.assertRaises(Http404):
+                self.get(path)
+        response = media(self.factory.post('/media/'), self.name)
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(TASK_RUN_LOCALLY=False, TASK_MAX_ATTEMPTS=2,
+                   TASK_RETRY_DELAY=60)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_priorities_and_keys(self):
+        low = tasks.enqueue(remember, 'low', priority=tasks.PRIORITY_LOW)
+        high = tasks.enqueue(remember, 'high', flag=True,
+                             priority=tasks.PRIORITY_HIGH, key='same')
+        self.assertIsNone(tasks.enqueue(remember, 'again', key='same'))
+        tasks.enqueue(remember, 'later', delay=60)
+        self.assertEqual(tasks.claim(5), [high.pk, low.pk])
+        self.assertEqual(tasks.claim(5), [])
+        self.assertTrue(tasks.execute(high.pk))
+        self.assertTrue(tasks.execute(low.pk))
+        self.assertEqual(calls, [(('high',), {'flag': True}), (('low',), {})])
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_retries_then_fails(self):
+        task = tasks.enqueue(flaky)
+        self.assertFalse(tasks.run(task.pk))
+        task.refresh_from_db()
+        self.assertFalse(task.failed)
+        self.assertIn('Сбой', task.last_error)
+        self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=50))
+        self.assertFalse(tasks.run(task.pk))
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        self.assertFalse(tasks.run(task.pk))
+        task.refresh_from_db()
+        self.assertTrue(task.failed)
+        self.assertEqual(task.attempts, 2)
+        self.assertEqual(tasks.claim(), [])
+
+    def test_running_task_does_not_block_key(self):
+        task = tasks.enqueue(remember, key='same')
+        self.assertEqual(tasks.claim(), [task.pk])
+        self.assertIsNotNone(tasks.enqueue(remember, key='same'))
+        self.assertIsNone(tasks.enqueue(remember, key='same'))
+
+    def test_expired_lock_is_claimed_again(self):
+        task = tasks.enqueue(remember)
+        self.assertEqual(tasks.claim(), [task.pk])
+        Task.objects.filter(pk=task.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(tasks.claim(), [task.pk])
+
+    @override_settings(TASK_RUN_LOCALLY=True, TASK_WORKERS=0)
+    def test_runs_after_commit(self):
+        with mock.patch.object(tasks.transaction, 'on_commit',
+                               side_effect=lambda func: func()):
+            tasks.enqueue(remember, 'now')
+        self.assertEqual(calls, [(('now',), {})])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASK_WORKERS=2)
+    def test_full_pool_leaves_task_in_table(self):
+        task = tasks.enqueue(remember, 'later')
+        executor = mock.Mock()
+        slots = mock.Mock(**{'acquire.return_value': False})
+        with mock.patch.object(tasks, 'get_executor',
+                               return_value=(executor, slots)):
+            self.assertFalse(tasks.submit(task.pk))
+        executor.submit.assert_not_called()
+        self.assertEqual(tasks.claim(), [task.pk])
+
+
+@override_settings(TASK_RUN_LOCALLY=False)
+class RunTasksTest(TransactionTestCase):
+    def test_run_tasks(self):
+        calls.clear()
+        for i in range(3):
+            tasks.enqueue(remember, i)
+        tasks.enqueue(flaky)
+        out = StringIO()
+        call_command('run_tasks', workers=2, burst=True, stdout=out)
+        self.assertIn('выполнено 3, с ошибкой 1', out.getvalue())
+        self.assertEqual(sorted(args for args, _ in calls),
+                         [(0,), (1,), (2,)])
+        self.assertEqual(Task.objects.get().attempts, 1)
+
+
+@override_settings(
+    EMAIL_BACKEND='core.mail.OutboxBackend',
+    OUTBOX_EMAIL_BACKEND='core.tests.FlakyEmailBackend',
+    TASK_RUN_LOCALLY=False, OUTBOX_MAX_ATTEMPTS=2,
+)
+class OutboxTest(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.opened = 0
+
+    def test_password_reset_goes_through_outbox(self):
+        get_user_model().objects.create_user(
+            'reader', 'reader@example.com', 'password'
+        )
+        self.client.post('/auth/password_reset/',
+                         {'email': 'reader@example.com'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.get().recipients,
+                         'reader@example.com')
+        self.assertEqual(Task.objects.get().name, 'core.mail.deliver')
+        self.assertEqual(deliver(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+        self.assertIn('/auth/reset/', mail.outbox[0].body)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_batches_share_connection_and_retry(self):
+        for address in ('a@example.com', 'broken@example.com',
+                        'b@example.com', 'c@example.com'):
+            mail.send_mail('Тема', 'Текст', None, [address])
+        self.assertEqual(deliver(batch_size=2), (3, 1))
+        self.assertEqual(len(mail.outbox), 3)
+        # Соединение переоткрывается только после ошибки.
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+        broken = OutboxMessage.objects.get()
+        self.assertFalse(broken.failed)
+        self.assertGreater(broken.run_at, timezone.now())
+        self.assertIn('Сервер не ответил', broken.last_error)
+        # Повтор ставит отложенную задачу доставки.
+        task = Task.objects.get(key=f'outbox:{broken.pk}')
+        self.assertEqual(task.name, 'core.mail.deliver')
+        self.assertGreaterEqual(task.run_at, broken.run_at)
+
+        OutboxMessage.objects.update(run_at=timezone.now())
+        out = StringIO()
+        call_command('send_outbox', stdout=out)
+        self.assertIn('Отправлено 0, отложено до повтора 1', out.getvalue())
+        self.assertTrue(OutboxMessage.objects.get().failed)
+        self.assertEqual(Task.objects.filter(
+            key=f'outbox:{broken.pk}'
+        ).count(), 1)
+        self.assertEqual(deliver(), (0, 0))
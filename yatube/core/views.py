@@ -1,4 +1,22 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .storage import HashedFileSystemStorage
+
+# Год - максимум, который имеет смысл указывать в max-age.
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 def page_not_found(request, exception):
@@ -15,3 +33,135 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+class RangeFile:
+    """Файл, из которого читается не больше length байт с текущей позиции.
+
+    У него нет fileno, поэтому WSGI-сервер не отдаст через sendfile
+    весь хвост файла, а будет читать ровно запрошенный диапазон.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """(начало, конец) единственного диапазона из заголовка Range.
+
+    None - заголовка нет или он не поддерживается, и нужно отдать файл
+    целиком. ValueError - диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N - последние N байт.
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def range_allowed(request, etag, last_modified):
+    """If-Range: диапазон отдаётся, только если файл не изменился."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return parse_etags(if_range) == [etag]
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def media_etag(path, stat):
+    if HashedFileSystemStorage.is_hashed_name(path):
+        name = posixpath.splitext(posixpath.basename(path))[0]
+        return f'"{name}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+@require_safe
+def media(request, path):
+    """Отдаёт загруженные файлы в продакшене.
+
+    Поддерживает If-None-Match/If-Modified-Since и один диапазон
+    в Range. Если задан MEDIA_SENDFILE_HEADER, сам файл отдаёт
+    фронтовой сервер по заголовку X-Accel-Redirect или X-Sendfile.
+    Иначе ответ - FileResponse, который WSGI-сервер отправляет
+    через wsgi.file_wrapper, то есть sendfile, где он есть. Файлы
+    с именем по хешу содержимого браузер может кэшировать навсегда.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+    etag = media_etag(path, stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = media_response(request, path, full_path, stat.st_size,
+                                  etag, last_modified)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if HashedFileSystemStorage.is_hashed_name(path):
+        patch_cache_control(response, public=True,
+                            max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
+def media_response(request, path, full_path, size, etag, last_modified):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    header = settings.MEDIA_SENDFILE_HEADER
+    if header:
+        # Range и отправку файла берёт на себя фронтовой сервер.
+        response = HttpResponse(content_type=content_type)
+        if header == 'X-Accel-Redirect':
+            response[header] = settings.MEDIA_ACCEL_PREFIX + path
+        else:
+            response[header] = full_path
+        return response
+    try:
+        byte_range = None
+        if range_allowed(request, etag, last_modified):
+            byte_range = parse_range(request.META.get('HTTP_RANGE', ''), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        file.seek(start)
+        if end < size - 1:
+            file = RangeFile(file, length)
+        response = FileResponse(file, status=206, content_type=content_type)
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
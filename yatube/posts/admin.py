@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Comment, Follow, Group, Post
+from . import search
+from .models import Comment, Follow, Group, Post, Tag
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -16,6 +17,14 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу FTS5 вместо LIKE '%...%' по всей таблице.
+        ids = search.matching_ids(search_term)
+        if ids is None:
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return queryset.filter(pk__in=ids), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -47,7 +56,21 @@ class CommentAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+class TagAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'kind',
+        'name',
+        'posts_count',
+    )
+    list_filter = ('kind',)
+    search_fields = ('name',)
+    readonly_fields = ('posts_count',)
+    empty_value_display = '-пусто-'
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(Tag, TagAdmin)
@@ -0,0 +1,308 @@
+import bisect
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count
+from django.urls import reverse
+
+from .models import Group, User
+
+# Журнал изменений в общем кэше: номер последнего изменения и записи
+# (ref, изменение) под своими номерами.
+SEQUENCE_KEY = 'autocomplete:sequence'
+LOG_KEY_PREFIX = 'autocomplete:log:'
+# Запись, которой нет дольше этого, считается потерянной, и индекс
+# перестраивается: обычно её просто ещё не успели записать.
+LOG_GAP_TIMEOUT = 5
+# Ответы на короткие префиксы запоминаются: под ними лежит большая
+# часть индекса, и каждый раз выбирать из неё лучших дорого.
+MEMO_PREFIX_LENGTH = 2
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е').strip()
+
+
+class PrefixIndex:
+    """Отсортированный массив ключей для поиска по префиксу.
+
+    Ключи - нормализованные username, имя, фамилия и полное имя
+    пользователя, название и slug группы. Поиск - bisect до первого
+    ключа с префиксом и проход до первого без него, из найденного
+    берутся top-k по популярности.
+    """
+
+    def __init__(self, entries=()):
+        # ref -> (популярность, подпись, (имя url, аргумент))
+        # и ref -> ключи. url строится только для попавших в ответ.
+        self.items = {}
+        self.terms = {}
+        pairs = []
+        for ref, terms, score, label, url in entries:
+            self.items[ref] = (score, label, url)
+            self.terms[ref] = self.normalize_terms(terms)
+            pairs.extend((term, ref) for term in self.terms[ref])
+        pairs.sort()
+        self.keys = [term for term, _ in pairs]
+        self.refs = [ref for _, ref in pairs]
+        self.memo = {}
+
+    @staticmethod
+    def normalize_terms(terms):
+        return {normalize(term) for term in terms if term}
+
+    def add(self, ref, terms, score, label, url):
+        self.remove(ref)
+        self.items[ref] = (score, label, url)
+        self.terms[ref] = self.normalize_terms(terms)
+        for term in self.terms[ref]:
+            position = bisect.bisect_left(self.keys, term)
+            self.keys.insert(position, term)
+            self.refs.insert(position, ref)
+        self.forget(self.terms[ref])
+
+    def remove(self, ref):
+        if self.items.pop(ref, None) is None:
+            return
+        terms = self.terms.pop(ref)
+        for term in terms:
+            position = bisect.bisect_left(self.keys, term)
+            while self.refs[position] != ref:
+                position += 1
+            del self.keys[position]
+            del self.refs[position]
+        self.forget(terms)
+
+    def forget(self, terms):
+        """Сбрасывает запомненные ответы на префиксы этих ключей:
+        остальные изменение не затрагивает."""
+        prefixes = {term[:length] for term in terms
+                    for length in range(1, MEMO_PREFIX_LENGTH + 1)}
+        for memo_key in [key for key in self.memo if key[0] in prefixes]:
+            del self.memo[memo_key]
+
+    def lookup(self, prefix, limit):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        memo_key = (prefix, limit)
+        if len(prefix) <= MEMO_PREFIX_LENGTH and memo_key in self.memo:
+            return self.memo[memo_key]
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', start)
+        refs = set(self.refs[start:end])
+        best = heapq.nlargest(limit, refs,
+                              key=lambda ref: (self.items[ref][0], ref))
+        results = [self.as_dict(ref) for ref in best]
+        if len(prefix) <= MEMO_PREFIX_LENGTH:
+            self.memo[memo_key] = results
+        return results
+
+    def as_dict(self, ref):
+        _, label, (view_name, arg) = self.items[ref]
+        return {
+            'type': ref[0],
+            'label': label,
+            'url': reverse(view_name, args=[arg]),
+        }
+
+
+def user_entry(user, followers=0, posts=0):
+    full_name = f'{user.first_name} {user.last_name}'.strip()
+    label = f'{full_name} ({user.username})' if full_name else user.username
+    return (
+        ('user', user.pk),
+        (user.username, user.first_name, user.last_name, full_name),
+        (followers, posts),
+        label,
+        ('posts:profile', user.username),
+    )
+
+
+def group_entry(group, posts=0):
+    return (
+        ('group', group.pk),
+        (group.title, group.slug, *group.title.split()),
+        (posts, 0),
+        group.title,
+        ('posts:group_list', group.slug),
+    )
+
+
+def entries():
+    users = User.objects.filter(is_active=True).select_related(
+        'stats'
+    ).only('pk', 'username', 'first_name', 'last_name',
+           'stats__followers_count', 'stats__posts_count')
+    for user in users.iterator(chunk_size=2000):
+        stats = getattr(user, 'stats', None)
+        yield user_entry(
+            user,
+            stats.followers_count if stats else 0,
+            stats.posts_count if stats else 0,
+        )
+    groups = Group.objects.annotate(posts=Count('group_posts'))
+    for group in groups:
+        yield group_entry(group, group.posts)
+
+
+def current_sequence():
+    """Номер последнего изменения в журнале.
+
+    Счётчик начинается с метки времени, поэтому после очистки кэша
+    новые номера оказываются далеко впереди прежних.
+    """
+    cache.add(SEQUENCE_KEY, int(time.time() * 1000) * 1000, timeout=None)
+    return cache.get(SEQUENCE_KEY, 0)
+
+
+def publish(ref, change):
+    """Записывает изменение в журнал. change - (ключи, подпись, url)
+    или None, если запись удалена."""
+    try:
+        sequence = cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        current_sequence()
+        sequence = cache.incr(SEQUENCE_KEY)
+    cache.set(LOG_KEY_PREFIX + str(sequence), (ref, change),
+              timeout=settings.AUTOCOMPLETE_REBUILD_INTERVAL)
+
+
+def apply(index, ref, change):
+    if change is None:
+        index.remove(ref)
+        return
+    terms, label, url = change
+    # Популярность до следующей перестройки остаётся прежней.
+    score = index.items.get(ref, ((0, 0),))[0]
+    index.add(ref, terms, score, label, url)
+
+
+class Autocomplete:
+    """Индекс процесса, который догоняет изменения.
+
+    Изменения из этого процесса применяются к индексу сразу, точечно,
+    и пишутся в журнал в общем кэше. Другие процессы при следующем
+    запросе применяют записи журнала, которых ещё не видели. Популярность
+    меняется с каждой подпиской, поэтому она обновляется не по
+    сигналам, а полной перестройкой раз в AUTOCOMPLETE_REBUILD_INTERVAL.
+    Перестройка идёт в отдельном потоке, запросы до её конца отвечают
+    по старому индексу.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.index = None
+        self.sequence = None
+        self.built_at = 0
+        self.gap_since = None
+        self.rebuilding = False
+
+    def get_index(self):
+        sequence = current_sequence()
+        with self.lock:
+            index = self.index
+            if index is not None:
+                fresh = self.catch_up(sequence) and (
+                    time.monotonic() - self.built_at
+                    <= settings.AUTOCOMPLETE_REBUILD_INTERVAL
+                )
+                if fresh or self.rebuilding:
+                    return index
+                self.rebuilding = True
+        if index is not None:
+            self.rebuild_in_background()
+            return index
+        # Первый индекс процесса строится в запросе: отвечать пока нечем.
+        with self.build_lock:
+            if self.index is None:
+                self.rebuild()
+        return self.index
+
+    def catch_up(self, sequence):
+        """Применяет записи журнала после self.sequence. Возвращает
+        False, если журнал не догнать и индекс надо перестроить."""
+        if sequence == self.sequence:
+            return True
+        if not 0 < sequence - self.sequence <= settings.AUTOCOMPLETE_LOG_SIZE:
+            return False
+        numbers = range(self.sequence + 1, sequence + 1)
+        log = cache.get_many([LOG_KEY_PREFIX + str(number)
+                              for number in numbers])
+        for number in numbers:
+            record = log.get(LOG_KEY_PREFIX + str(number))
+            if record is None:
+                if self.gap_since is None:
+                    self.gap_since = time.monotonic()
+                return time.monotonic() - self.gap_since <= LOG_GAP_TIMEOUT
+            apply(self.index, *record)
+            self.sequence = number
+            self.gap_since = None
+        return True
+
+    def rebuild(self):
+        """Строит индекс заново вне блокировки и подменяет им текущий.
+        Записи журнала, появившиеся во время сборки, применятся
+        к новому индексу при следующем запросе."""
+        sequence = current_sequence()
+        index = PrefixIndex(entries())
+        with self.lock:
+            self.index = index
+            self.sequence = sequence
+            self.built_at = time.monotonic()
+            self.gap_since = None
+
+    def rebuild_in_background(self):
+        """Перестраивает индекс в отдельном потоке, а при
+        TASK_WORKERS = 0, как и фоновые задачи, в текущем."""
+        if not settings.TASK_WORKERS:
+            try:
+                self.rebuild()
+            finally:
+                self.rebuilding = False
+            return
+        threading.Thread(target=self.rebuild_worker, daemon=True).start()
+
+    def rebuild_worker(self):
+        try:
+            self.rebuild()
+        finally:
+            self.rebuilding = False
+            connections.close_all()
+
+    def lookup(self, prefix, limit=None):
+        limit = min(limit or settings.AUTOCOMPLETE_LIMIT,
+                    settings.AUTOCOMPLETE_LIMIT)
+        index = self.get_index()
+        with self.lock:
+            return index.lookup(prefix, limit)
+
+    def changed(self, ref, change):
+        """Применяет изменение к своему индексу и пишет его в журнал
+        для остальных процессов."""
+        publish(ref, change)
+        with self.lock:
+            if self.index is not None:
+                apply(self.index, ref, change)
+
+    def user_changed(self, user):
+        if not user.is_active:
+            self.removed('user', user.pk)
+            return
+        ref, terms, _, label, url = user_entry(user)
+        self.changed(ref, (terms, label, url))
+
+    def group_changed(self, group):
+        ref, terms, _, label, url = group_entry(group)
+        self.changed(ref, (terms, label, url))
+
+    def removed(self, kind, pk):
+        self.changed((kind, pk), None)
+
+
+autocomplete = Autocomplete()
@@ -0,0 +1,109 @@
+import hashlib
+import math
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition
+
+KEY_PREFIX = 'version:'
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """Возвращает версии областей кэша, заводя недостающие.
+
+    Версия - это метка времени последнего изменения в миллисекундах,
+    поэтому после очистки кэша она всегда оказывается новее прежней.
+    """
+    keys = [KEY_PREFIX + scope for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: _now() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Сдвигает версии областей после коммита текущей транзакции.
+
+    Иначе параллельный запрос успел бы прочитать ещё старые строки
+    и закэшировать их под новой версией - до следующего изменения.
+    Вне транзакции версии сдвигаются сразу.
+    """
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    keys = [KEY_PREFIX + scope for scope in scopes]
+    current = cache.get_many(keys)
+    now = _now()
+    cache.set_many(
+        {key: max(now, current.get(key, 0) + 1) for key in keys},
+        timeout=None
+    )
+
+
+def version_key(*scopes):
+    return '-'.join(str(version) for version in get_versions(*scopes))
+
+
+def fragment_context(*scopes):
+    """Контекст для {% cache %} во фрагментах лент."""
+    return {
+        'cache_version': version_key(*scopes),
+        'cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+    }
+
+
+def conditional(get_scopes):
+    """Отдаёт 304 по ETag/Last-Modified, не выполняя саму вьюху.
+
+    get_scopes(request, **kwargs) возвращает области кэша страницы или
+    None, если страницы нет. Версии областей - метки времени изменений,
+    поэтому из них же получается Last-Modified.
+    """
+    def versions(request, *args, **kwargs):
+        if not hasattr(request, 'scope_versions'):
+            scopes = get_scopes(request, *args, **kwargs)
+            request.scope_versions = (
+                None if scopes is None else get_versions(*scopes)
+            )
+        return request.scope_versions
+
+    def etag(request, *args, **kwargs):
+        current = versions(request, *args, **kwargs)
+        if current is None:
+            return None
+        parts = [str(version) for version in current]
+        parts.append(str(request.user.pk or 0))
+        if request.user.is_authenticated:
+            # В формах страницы CSRF-токен, который меняется при входе:
+            # 304 оставил бы в браузере форму со старым токеном.
+            get_token(request)
+            parts.append(hashlib.md5(
+                request.META['CSRF_COOKIE'].encode()
+            ).hexdigest()[:8])
+        return '-'.join(parts)
+
+    def last_modified(request, *args, **kwargs):
+        current = versions(request, *args, **kwargs)
+        if current is None:
+            return None
+        # В заголовке секунды, а версии в миллисекундах. Время
+        # округляется вверх и отдаётся, только когда эта секунда
+        # прошла: следующее изменение получит Last-Modified позже,
+        # и If-Modified-Since не вернёт 304 на устаревшую страницу.
+        seconds = math.ceil(max(current) / 1000)
+        if seconds > time.time():
+            return None
+        return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,100 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, User, UserStats
+
+
+def _count_subquery(queryset, field):
+    counted = queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+        field
+    ).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counted), 0)
+
+
+def with_actual_user_counts(queryset):
+    """Аннотирует пользователей честно посчитанными значениями счётчиков."""
+    return queryset.annotate(
+        actual_posts=_count_subquery(Post.objects, 'author'),
+        actual_followers=_count_subquery(Follow.objects, 'author'),
+        actual_following=_count_subquery(Follow.objects, 'user'),
+    )
+
+
+def with_actual_post_counts(queryset):
+    return queryset.annotate(
+        actual_comments=_count_subquery(Comment.objects, 'post'),
+    )
+
+
+def drifted_user_stats(users):
+    """Строки UserStats пользователей, чьи счётчики разошлись с данными,
+    уже с верными значениями. Недостающие строки тоже попадают сюда.
+
+    Пользователи должны быть аннотированы with_actual_user_counts
+    и выбраны вместе со stats.
+    """
+    drifted = []
+    for user in users:
+        stats = getattr(user, 'stats', None) or UserStats(user=user)
+        actual = (user.actual_posts, user.actual_followers,
+                  user.actual_following)
+        stored = (stats.posts_count, stats.followers_count,
+                  stats.following_count)
+        if stats.pk is not None and actual == stored:
+            continue
+        (stats.posts_count, stats.followers_count,
+         stats.following_count) = actual
+        drifted.append(stats)
+    return drifted
+
+
+def drifted_posts(posts):
+    """Посты с разошедшимся comments_count, уже с верным значением.
+    Посты должны быть аннотированы with_actual_post_counts."""
+    drifted = [post for post in posts
+               if post.comments_count != post.actual_comments]
+    for post in drifted:
+        post.comments_count = post.actual_comments
+    return drifted
+
+
+def recount_user(user_id):
+    user = with_actual_user_counts(User.objects.filter(pk=user_id)).first()
+    if user is None:
+        return None
+    stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'posts_count': user.actual_posts,
+            'followers_count': user.actual_followers,
+            'following_count': user.actual_following,
+        }
+    )
+    return stats
+
+
+def get_stats(user):
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return recount_user(user.pk)
+
+
+def bump_user(user_id, field, delta):
+    """Сдвигает счётчик пользователя одним UPDATE.
+
+    Если строки со счётчиками ещё нет, она создаётся пересчётом -
+    но только при росте: при каскадном удалении пользователя
+    воскрешать его счётчики нельзя.
+    """
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta}
+    )
+    if not updated and delta > 0:
+        recount_user(user_id)
+
+
+def bump_post_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
@@ -0,0 +1,82 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, StreamingHttpResponse
+
+CHUNK_SIZE = 2000
+# Поле выгрузки и путь к нему в запросе.
+FIELDS = {
+    'id': 'pk',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def rows(queryset):
+    """Кортежи значений постов без создания моделей.
+
+    iterator() читает результат порциями и не кладёт его в кэш
+    queryset, поэтому память не зависит от числа постов.
+    """
+    return queryset.order_by('pk').values_list(
+        *FIELDS.values()
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """Файлоподобный объект для csv.writer: строку не буферизует,
+    а возвращает её, чтобы отдать следующим куском ответа."""
+
+    def write(self, value):
+        return value
+
+
+def as_csv(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows(queryset):
+        yield writer.writerow(row)
+
+
+def as_json(queryset):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    yield '['
+    separator = '\n'
+    for row in rows(queryset):
+        yield separator + encoder.encode(dict(zip(FIELDS, row)))
+        separator = ',\n'
+    yield '\n]\n'
+
+
+EXPORTERS = {
+    'json': as_json,
+    'csv': as_csv,
+}
+
+
+def export_response(queryset, export_format, filename):
+    """Ответ, который отдаёт выгрузку по мере чтения из базы:
+    первый байт уходит сразу, а не после загрузки всех постов."""
+    if export_format not in EXPORTERS:
+        raise Http404('Неизвестный формат выгрузки')
+    response = StreamingHttpResponse(
+        EXPORTERS[export_format](queryset),
+        content_type=CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{filename}.{export_format}"'
+    )
+    return response
+
+
+def write_export(queryset, export_format, file):
+    for chunk in EXPORTERS[export_format](queryset):
+        file.write(chunk)
@@ -1,5 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 
+from .images import normalize_image
 from .models import Comment, Post
 
 
@@ -22,6 +25,15 @@ class PostForm(forms.ModelForm):
             raise forms.ValidationError('Воу! Это обязательное поле')
         return data
 
+    def clean_image(self):
+        data = self.cleaned_data['image']
+        if not isinstance(data, UploadedFile):
+            return data
+        try:
+            return normalize_image(data)
+        except (OSError, Image.DecompressionBombError):
+            raise forms.ValidationError('Не получилось обработать картинку')
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
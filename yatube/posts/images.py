@@ -0,0 +1,137 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, ImageOps
+
+# Значения тега Orientation, при которых браузер поворачивает
+# картинку на 90 градусов и ширина с высотой меняются местами.
+ROTATED = {5, 6, 7, 8}
+EXIF_ORIENTATION = 0x0112
+# Цвет заглушки считается по уменьшенной копии, а не по всей картинке.
+COLOR_SAMPLE = (64, 64)
+# Расширение и MIME-тип для форматов, в которые пересохраняются загрузки.
+FORMATS = {
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+
+
+def read_image_info(file):
+    """Размеры, размер файла и средний цвет картинки.
+
+    Возвращает словарь со значениями полей Post.image_*. Позиция
+    в файле восстанавливается, чтобы его можно было сохранить дальше.
+    """
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION) in ROTATED:
+                width, height = height, width
+            # Для JPEG draft декодирует сразу в уменьшенном масштабе.
+            image.draft('RGB', COLOR_SAMPLE)
+            red, green, blue = image.convert('RGB').resize(
+                (1, 1), Image.BOX
+            ).getpixel((0, 0))
+    finally:
+        file.seek(position)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': file.size,
+        'image_color': f'#{red:02x}{green:02x}{blue:02x}',
+    }
+
+
+def fill_image_info(post):
+    """Заполняет поля Post.image_* по файлу картинки.
+
+    Для поста без картинки или с нечитаемым файлом поля очищаются.
+    Возвращает True, если картинку удалось прочитать.
+    """
+    info = {
+        'image_width': None,
+        'image_height': None,
+        'image_size': None,
+        'image_color': '',
+    }
+    readable = False
+    if post.image:
+        try:
+            post.image.open()
+            info = read_image_info(post.image)
+            readable = True
+        except (OSError, ValueError, SuspiciousFileOperation,
+                Image.DecompressionBombError):
+            pass
+    for field, value in info.items():
+        setattr(post, field, value)
+    return readable
+
+
+def needs_normalizing(image, max_side, image_format):
+    if getattr(image, 'is_animated', False):
+        # Анимацию пересохранение в JPEG или WebP превратило бы в кадр.
+        return False
+    return (image.format != image_format
+            or max(image.size) > max_side
+            or 'exif' in image.info
+            or len(image.getexif()) > 0)
+
+
+def flatten(image, image_format):
+    """Приводит режим к поддерживаемому форматом: для JPEG прозрачность
+    заливается белым, WebP её сохраняет."""
+    has_alpha = (image.mode in ('RGBA', 'LA', 'PA')
+                 or 'transparency' in image.info)
+    if not has_alpha:
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    if image_format == 'WEBP':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def normalize_image(file, max_side=None, image_format=None, quality=None):
+    """Уменьшает загруженную картинку, убирает метаданные и пересохраняет
+    её в POST_IMAGE_FORMAT.
+
+    Картинка читается из файла потоком, большой JPEG сразу декодируется
+    в уменьшенном масштабе (draft). Результат пишется во временный
+    файл, который держится в памяти, пока не перерастёт
+    FILE_UPLOAD_MAX_MEMORY_SIZE. Если менять нечего, возвращается
+    исходный файл.
+    """
+    max_side = max_side or settings.POST_IMAGE_MAX_SIDE
+    image_format = image_format or settings.POST_IMAGE_FORMAT
+    quality = quality or settings.POST_IMAGE_QUALITY
+    file.seek(0)
+    with Image.open(file) as image:
+        if not needs_normalizing(image, max_side, image_format):
+            file.seek(0)
+            return file
+        icc_profile = image.info.get('icc_profile')
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image = flatten(image, image_format)
+        output = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        options = {'quality': quality}
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        if image_format == 'JPEG':
+            options.update(optimize=True, progressive=True)
+        image.save(output, image_format, **options)
+    extension, content_type = FORMATS[image_format]
+    name = os.path.splitext(os.path.basename(file.name))[0] + extension
+    size = output.tell()
+    output.seek(0)
+    return UploadedFile(output, name=name, content_type=content_type,
+                        size=size)
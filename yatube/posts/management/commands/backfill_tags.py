@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import tags
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Разбирает хештеги и упоминания в уже опубликованных постах '
+            'и пересчитывает счётчики тегов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=tags.BATCH_SIZE,
+            help='Сколько постов разбирать в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        done = 0
+        changed = set()
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_pk)
+                .only('pk', 'text', 'pub_date').order_by('pk')[:batch_size]
+            )
+            if not posts:
+                break
+            with transaction.atomic():
+                changed |= tags.update_posts(posts)
+            last_pk = posts[-1].pk
+            done += len(posts)
+            self.stdout.write(f'Обработано постов: {done}')
+        fixed, deleted = tags.recount()
+        self.stdout.write(self.style.SUCCESS(
+            f'Теги заполнены: изменено тегов {len(changed)}, исправлено '
+            f'счётчиков {fixed}, удалено пустых тегов {deleted}'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+from posts.models import Follow
+
+
+class Command(BaseCommand):
+    help = 'Заполняет материализованные ленты подписок по таблице Follow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=timeline.BATCH_SIZE,
+            help='Сколько подписок обрабатывать за один проход.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        done = 0
+        while True:
+            follows = list(
+                Follow.objects.filter(pk__gt=last_pk)
+                .order_by('pk')[:batch_size]
+            )
+            if not follows:
+                break
+            for follow in follows:
+                timeline.add_author(follow.user_id, follow.author_id)
+            last_pk = follows[-1].pk
+            done += len(follows)
+            self.stdout.write(f'Обработано подписок: {done}')
+        self.stdout.write(self.style.SUCCESS('Ленты заполнены'))
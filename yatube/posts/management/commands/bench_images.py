@@ -0,0 +1,97 @@
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from posts import images
+
+# Размер снимка с камеры телефона и значение Orientation «повернуть на 90».
+PHOTO_SIZE = (4032, 3024)
+ROTATE_90 = 6
+
+
+def make_photo(size=PHOTO_SIZE):
+    """JPEG, похожий на фото с телефона: шум поверх градиента и EXIF."""
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    photo = Image.merge('RGB', (gradient, noise, gradient.transpose(
+        Image.FLIP_LEFT_RIGHT
+    )))
+    exif = Image.Exif()
+    exif[images.EXIF_ORIENTATION] = ROTATE_90
+    content = BytesIO()
+    photo.save(content, 'JPEG', quality=95, exif=exif.tobytes())
+    return content.getvalue()
+
+
+class Command(BaseCommand):
+    help = ('Меряет, сколько байт экономит и сколько процессорного '
+            'времени стоит обработка загруженной картинки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Картинки для замера. Без них используется '
+                 'сгенерированное фото 4032x3024.'
+        )
+        parser.add_argument(
+            '--format', action='append', dest='formats',
+            choices=sorted(images.FORMATS),
+            help='Формат результата, можно указать несколько раз.'
+        )
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['paths']:
+            samples = []
+            for path in options['paths']:
+                with open(path, 'rb') as file:
+                    samples.append((os.path.basename(path), file.read()))
+        else:
+            samples = [('photo.jpg', make_photo())]
+        formats = options['formats'] or sorted(images.FORMATS)
+        totals = {image_format: [0, 0, 0.0] for image_format in formats}
+        for name, content in samples:
+            for image_format in formats:
+                size, cpu = self.measure(name, content, image_format,
+                                         options['repeat'])
+                total = totals[image_format]
+                total[0] += len(content)
+                total[1] += size
+                total[2] += cpu
+                self.stdout.write(
+                    f'{name} -> {image_format}: '
+                    f'{len(content) / 1024:.0f} КБ -> {size / 1024:.0f} КБ '
+                    f'({self.saved(len(content), size)}), '
+                    f'CPU {cpu * 1000:.0f} мс'
+                )
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Итого по {len(samples)} картинкам, '
+            f'сторона до {settings.POST_IMAGE_MAX_SIDE}px:'
+        ))
+        for image_format, (before, after, cpu) in totals.items():
+            self.stdout.write(
+                f'  {image_format:<5} '
+                f'сэкономлено {self.saved(before, after)}, '
+                f'CPU {cpu / len(samples) * 1000:.0f} мс на загрузку'
+            )
+
+    @staticmethod
+    def measure(name, content, image_format, repeat):
+        best = None
+        for _ in range(repeat):
+            upload = SimpleUploadedFile(name, content)
+            started = time.process_time()
+            result = images.normalize_image(upload,
+                                            image_format=image_format)
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return result.size, best
+
+    @staticmethod
+    def saved(before, after):
+        return f'{(before - after) / before:.0%}' if before else '0%'
@@ -0,0 +1,156 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from posts import timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+BENCH_INDEXES = {
+    Post: (
+        'post_pub_date_idx', 'post_author_date_idx', 'post_group_date_idx'
+    ),
+    Comment: ('comment_post_created_idx',),
+    Follow: ('follow_author_user_idx',),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Засевает базу большим набором данных и сравнивает планы '
+            'и время запросов лент с индексами и без них. Всё выполняется '
+            'в одной транзакции, которая в конце откатывается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.options = options
+        try:
+            with transaction.atomic():
+                self.seed()
+                self.run_index_sql('remove_sql')
+                without_indexes = self.measure()
+                self.run_index_sql('create_sql')
+                with_indexes = self.measure()
+                raise Rollback
+        except Rollback:
+            pass
+        self.report('Без индексов', without_indexes)
+        self.report('С индексами', with_indexes)
+        self.stdout.write('Время, мс (без -> с индексами):')
+        for name, (_, seconds) in with_indexes.items():
+            before = without_indexes[name][1] * 1000
+            self.stdout.write(
+                f'  {name:<12} {before:9.2f} -> {seconds * 1000:9.2f}'
+            )
+
+    def seed(self):
+        options = self.options
+        rnd = random.Random(0)
+        prefix = f'bench{time.time_ns()}'
+        User.objects.bulk_create(
+            (User(username=f'{prefix}_{i}')
+             for i in range(options['users'])),
+            batch_size=500,
+        )
+        users = list(User.objects.filter(username__startswith=prefix)
+                     .values_list('pk', flat=True))
+        Group.objects.bulk_create(
+            (Group(title=f'Группа {i}', slug=f'{prefix}-{i}',
+                   description='')
+             for i in range(options['groups'])),
+            batch_size=500,
+        )
+        groups = list(Group.objects.filter(slug__startswith=prefix)
+                      .values_list('pk', flat=True))
+        Post.objects.bulk_create(
+            (Post(text=f'Пост {i}', author_id=rnd.choice(users),
+                  group_id=rnd.choice(groups + [None]))
+             for i in range(options['posts'])),
+            batch_size=500,
+        )
+        posts = list(Post.objects.filter(author_id__in=users)
+                     .values_list('pk', flat=True))
+        Comment.objects.bulk_create(
+            (Comment(text='Комментарий', post_id=rnd.choice(posts),
+                     author_id=rnd.choice(users))
+             for _ in range(options['comments'])),
+            batch_size=500,
+        )
+        pairs = {tuple(rnd.sample(users, 2))
+                 for _ in range(options['follows'])}
+        Follow.objects.bulk_create(
+            (Follow(user_id=user, author_id=author)
+             for user, author in pairs),
+            batch_size=500,
+        )
+        self.author = User.objects.get(pk=users[0])
+        self.group = Group.objects.get(pk=groups[0])
+        self.post = Post.objects.get(pk=posts[len(posts) // 2])
+        self.reader = User.objects.get(pk=pairs.pop()[0])
+        for author_id in self.reader.follower.values_list('author',
+                                                          flat=True):
+            timeline.add_author(self.reader.pk, author_id)
+        self.stdout.write(f'Засеяно постов: {len(posts)}')
+
+    def queries(self):
+        page = settings.COUNT_PAGE
+        deep = self.options['posts'] // 2
+        return {
+            'index': Post.objects.all()[:page],
+            'index_deep': Post.objects.all()[deep:deep + page],
+            'profile': self.author.posts.all()[:page],
+            'group': self.group.group_posts.all()[:page],
+            'comments': self.post.comments.all(),
+            'followers': Follow.objects.filter(
+                author=self.author
+            ).values_list('user', flat=True),
+            'follow': Post.objects.filter(
+                timeline_entries__user=self.reader
+            ).order_by(
+                F('timeline_entries__pub_date').desc(),
+                F('timeline_entries__post_id').desc()
+            )[:page],
+        }
+
+    def measure(self):
+        results = {}
+        for name, queryset in self.queries().items():
+            plan = queryset.explain()
+            best = None
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter()
+                list(queryset._chain())
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (plan, best)
+        return results
+
+    def run_index_sql(self, method):
+        # Сначала меряем без индексов: SQLite строит EXPLAIN при подготовке
+        # запроса, и закэшированный план не заметил бы удаления индекса.
+        with connection.cursor() as cursor:
+            editor = connection.schema_editor()
+            for model, names in BENCH_INDEXES.items():
+                for index in model._meta.indexes:
+                    if index.name in names:
+                        sql = getattr(index, method)(model, editor)
+                        cursor.execute(str(sql))
+
+    def report(self, title, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, (plan, _) in results.items():
+            self.stdout.write(f'-- {name}')
+            self.stdout.write(plan)
@@ -0,0 +1,90 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search
+from posts.models import Post, User
+
+WORDS = ('кот', 'собака', 'город', 'река', 'поезд', 'книга', 'музыка',
+         'лето', 'зима', 'работа', 'дорога', 'море', 'гора', 'лес', 'дом',
+         'утро', 'вечер', 'друг', 'письмо', 'окно')
+# Редкое слово: LIKE всё равно читает всю таблицу, индексу это дёшево.
+RARE_WORD = 'фотосинтез'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Засевает базу постами и сравнивает поиск через индекс FTS5 '
+            'с LIKE по всей таблице. Всё выполняется в транзакции, '
+            'которая в конце откатывается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--words', type=int, default=40,
+                            help='Слов в одном посте.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            'queries', nargs='*',
+            help='Запросы для замера. По умолчанию частое слово, '
+                 'редкое и два слова сразу.'
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError('Индекс FTS5 есть только в SQLite')
+        queries = options['queries'] or [WORDS[0], RARE_WORD,
+                                         f'{WORDS[1]} {WORDS[2]}']
+        try:
+            with transaction.atomic():
+                self.seed(options['posts'], options['words'])
+                results = [self.measure(query, options['repeat'])
+                           for query in queries]
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write('Время первой страницы, мс (LIKE -> FTS5):')
+        for query, found, like, fts in results:
+            self.stdout.write(
+                f'  {query:<20} найдено {found:>7}  '
+                f'{like * 1000:9.2f} -> {fts * 1000:9.2f}'
+            )
+
+    def seed(self, count, words):
+        rnd = random.Random(0)
+        author = User.objects.create(username=f'bench{time.time_ns()}')
+        Post.objects.bulk_create(
+            (Post(author=author, text=self.make_text(rnd, words, i))
+             for i in range(count)),
+            batch_size=500,
+        )
+        self.stdout.write(f'Засеяно постов: {count}')
+
+    @staticmethod
+    def make_text(rnd, words, number):
+        text = ' '.join(rnd.choice(WORDS) for _ in range(words))
+        return f'{text} {RARE_WORD}' if number % 1000 == 0 else text
+
+    def measure(self, query, repeat):
+        like = Post.objects.all()
+        for word in query.split():
+            like = like.filter(text__icontains=word)
+        like = like.order_by('-pub_date')[:10]
+        fts = search.search(query).order_by('rank', 'pk')[:10]
+        found = search.search(query).count()
+        return (query, found, self.best(like, repeat),
+                self.best(fts, repeat))
+
+    @staticmethod
+    def best(queryset, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset._chain())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
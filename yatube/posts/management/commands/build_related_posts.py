@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import related
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие посты по TF-IDF для новых и изменённых '
+            'постов. Запускается из cron или с --loop.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать списки всех постов, а не только изменённых.'
+        )
+        parser.add_argument(
+            '--block-size', type=int,
+            help='Сколько постов сравнивать со всеми за одно умножение '
+                 'матриц. По умолчанию RELATED_BLOCK_SIZE.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Не выходить, а повторять каждые '
+                 'RELATED_UPDATE_INTERVAL секунд.'
+        )
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            updated, extended = related.update(full, options['block_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Пересчитано постов: {updated}, '
+                f'дополнено списков: {extended}'
+            ))
+            if not options['loop']:
+                break
+            full = False
+            time.sleep(settings.RELATED_UPDATE_INTERVAL)
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = ('Записывает остывание счёта постов в «Популярном». Обычно это '
+            'делает фоновая задача, команда - для cron и первого запуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=trending.BATCH_SIZE,
+            help='Сколько постов пересчитывать в одной транзакции.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Не выходить, а повторять каждые '
+                 'TRENDING_DECAY_INTERVAL секунд.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            updated, dropped = trending.decay(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Остужено постов: {updated}, выпало из ленты: {dropped}'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(settings.TRENDING_DECAY_INTERVAL)
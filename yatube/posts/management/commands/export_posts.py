@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import exports
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Выгружает посты автора, группы или всего сайта в JSON или CSV, '
+            'читая их из базы порциями.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', help='Username автора.')
+        parser.add_argument('--group', help='Slug группы.')
+        parser.add_argument(
+            '--format', choices=sorted(exports.EXPORTERS), default='json',
+            dest='export_format'
+        )
+        parser.add_argument(
+            '--output', help='Файл выгрузки. По умолчанию стандартный вывод.'
+        )
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.all()
+        if options['author']:
+            queryset = queryset.filter(author__username=options['author'])
+        if options['group']:
+            queryset = queryset.filter(group__slug=options['group'])
+        if not options['output']:
+            self.stdout.ending = ''
+            exports.write_export(queryset, options['export_format'],
+                                 self.stdout)
+            return
+        try:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as file:
+                exports.write_export(queryset, options['export_format'],
+                                     file)
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгрузка записана в {options["output"]}'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts import images
+from posts.models import Post
+from posts.signals import bump_post_scopes
+
+FIELDS = ('image_width', 'image_height', 'image_size', 'image_color',
+          'updated')
+
+
+class Command(BaseCommand):
+    help = ('Заполняет размеры, размер файла и цвет заглушки картинок '
+            'у постов, загруженных до появления этих полей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько постов обрабатывать за один проход.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Post.objects.filter(image__gt='').filter(
+            image_width__isnull=True
+        ).only('pk', 'author_id', 'group_id', 'image').order_by('pk')
+        last_pk = 0
+        done = failed = 0
+        while True:
+            posts = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not posts:
+                break
+            filled = []
+            for post in posts:
+                if images.fill_image_info(post):
+                    post.updated = timezone.now()
+                    filled.append(post)
+                else:
+                    failed += 1
+                post.image.close()
+            Post.objects.bulk_update(filled, FIELDS)
+            for post in filled:
+                bump_post_scopes(post.author_id, post.group_id,
+                                 post_id=post.pk)
+            last_pk = posts[-1].pk
+            done += len(filled)
+            self.stdout.write(f'Заполнено постов: {done}, ошибок: {failed}')
+        self.stdout.write(self.style.SUCCESS('Данные картинок заполнены'))
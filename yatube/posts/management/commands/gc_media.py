@@ -0,0 +1,216 @@
+import json
+import os
+import posixpath
+import re
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from sorl import thumbnail
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts import thumbnails
+from posts.models import Post
+
+PHASES = ('originals', 'kvstore', 'thumbnails')
+# Миниатюра для экранов с повышенной плотностью: name@2x.jpg.
+RESOLUTION_SUFFIX_RE = re.compile(r'@[\d.]+x(?=\.\w+$)')
+
+
+def walk(storage, root, after=''):
+    """Файлы хранилища под root в порядке сортировки путей,
+    начиная с пути, следующего за after."""
+    after_parts = tuple(after.split('/')) if after else ()
+    try:
+        directories, files = storage.listdir(root)
+    except FileNotFoundError:
+        return
+    entries = [(name, True) for name in directories]
+    entries += [(name, False) for name in files]
+    for name, is_directory in sorted(entries):
+        path = posixpath.join(root, name)
+        parts = tuple(path.split('/'))
+        if is_directory:
+            # Каталог целиком до точки возобновления пропускается.
+            if parts < after_parts[:len(parts)]:
+                continue
+            yield from walk(storage, path, after)
+        elif parts > after_parts:
+            yield path
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки, на которые не ссылается ни один пост, '
+            'их записи в kvstore sorl и осиротевшие файлы миниатюр. '
+            'Обход идёт порциями и может быть продолжен с места остановки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов или записей проверять за один запрос.'
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Не больше стольких проверок в секунду, 0 - без ограничения.'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: их пост может '
+                 'быть ещё не сохранён.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с позицией обхода. Если он есть, обход продолжается '
+                 'с этого места.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что было бы удалено.'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.newer_than = timezone.now() - timedelta(
+            seconds=options['min_age']
+        )
+        self.image_storage = Post._meta.get_field('image').storage
+        self.deleted = dict.fromkeys(PHASES, 0)
+        # При dry-run удалённые картинки остаются в kvstore, их не нужно
+        # считать второй раз.
+        self.deleted_originals = set()
+        phase, after = self.read_checkpoint()
+        for name in PHASES[PHASES.index(phase):]:
+            scan = getattr(self, f'scan_{name}')
+            for batch in self.batches(scan(after)):
+                started = time.monotonic()
+                self.deleted[name] += getattr(self, f'collect_{name}')(batch)
+                self.write_checkpoint(name, batch[-1])
+                self.throttle(len(batch), started)
+                self.stdout.write(f'{name}: проверено до {batch[-1]}, '
+                                  f'удалено {self.deleted[name]}')
+            after = ''
+        checkpoint = options['checkpoint']
+        if checkpoint and not self.dry_run and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        verb = 'Будет удалено' if self.dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb}: картинок {self.deleted["originals"]}, '
+            f'записей kvstore {self.deleted["kvstore"]}, '
+            f'миниатюр {self.deleted["thumbnails"]}'
+        ))
+
+    def batches(self, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def is_fresh(self, storage, name):
+        try:
+            return storage.get_modified_time(name) > self.newer_than
+        except OSError:
+            return True
+
+    def scan_originals(self, after):
+        upload_to = Post._meta.get_field('image').upload_to
+        return walk(self.image_storage, upload_to.rstrip('/'), after)
+
+    def collect_originals(self, names):
+        used = set(Post.objects.filter(image__in=names)
+                   .values_list('image', flat=True))
+        orphans = [name for name in names if name not in used
+                   and not self.is_fresh(self.image_storage, name)]
+        for name in orphans:
+            self.delete(name, thumbnail.delete, thumbnails.get_source(name))
+        if self.dry_run:
+            self.deleted_originals.update(orphans)
+        return len(orphans)
+
+    def scan_kvstore(self, after):
+        # Записи identity=thumbnails есть только у исходных картинок.
+        prefix = add_prefix('', identity='thumbnails')
+        queryset = KVStore.objects.filter(key__startswith=prefix).order_by(
+            'key'
+        ).values_list('key', flat=True)
+        if after:
+            queryset = queryset.filter(key__gt=add_prefix(
+                after, identity='thumbnails'
+            ))
+        last_key = None
+        while True:
+            if last_key is not None:
+                queryset = queryset.filter(key__gt=last_key)
+            keys = list(queryset[:self.batch_size])
+            if not keys:
+                return
+            yield from (del_prefix(key) for key in keys)
+            last_key = keys[-1]
+
+    def collect_kvstore(self, keys):
+        sources = {}
+        for key in keys:
+            source = default.kvstore._get(key)
+            if source is not None:
+                sources[source.name] = source
+        used = set(Post.objects.filter(image__in=sources)
+                   .values_list('image', flat=True))
+        orphans = [source for name, source in sources.items()
+                   if name not in used and name not in self.deleted_originals]
+        for source in orphans:
+            self.delete(source.name, default.kvstore.delete, source)
+        return len(orphans)
+
+    def scan_thumbnails(self, after):
+        return walk(default.storage,
+                    sorl_settings.THUMBNAIL_PREFIX.rstrip('/'), after)
+
+    def collect_thumbnails(self, names):
+        orphans = 0
+        for name in names:
+            base_name = RESOLUTION_SUFFIX_RE.sub('', name)
+            known = default.kvstore.get(ImageFile(base_name, default.storage))
+            if known is None and not self.is_fresh(default.storage, name):
+                self.delete(name, default.storage.delete, name)
+                orphans += 1
+        return orphans
+
+    def delete(self, name, delete, *args):
+        if self.dry_run:
+            self.stdout.write(f'  {name}')
+        else:
+            delete(*args)
+
+    def throttle(self, count, started):
+        if not self.options['rate']:
+            return
+        delay = count / self.options['rate'] - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+
+    def read_checkpoint(self):
+        checkpoint = self.options['checkpoint']
+        if not checkpoint or not os.path.exists(checkpoint):
+            return PHASES[0], ''
+        with open(checkpoint) as file:
+            position = json.load(file)
+        return position['phase'], position['after']
+
+    def write_checkpoint(self, phase, after):
+        checkpoint = self.options['checkpoint']
+        if not checkpoint or self.dry_run:
+            return
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'phase': phase, 'after': after}, file)
+        os.replace(temporary, checkpoint)
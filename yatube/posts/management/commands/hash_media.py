@@ -0,0 +1,92 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from sorl import thumbnail
+
+from posts import thumbnails
+from posts.models import Post
+from posts.signals import bump_post_scopes
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов, загруженные до хранилища с именами '
+            'по хешу, под новые имена и переписывает ссылки на них.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько постов обрабатывать за один проход.'
+        )
+        parser.add_argument(
+            '--delete-old', action='store_true',
+            help='Удалять старые файлы и их миниатюры, на которые '
+                 'больше не ссылается ни один пост.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать картинки со старыми именами.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.storage = Post._meta.get_field('image').storage
+        queryset = Post.objects.filter(image__gt='').only(
+            'pk', 'author_id', 'group_id', 'image', 'image_width'
+        ).order_by('pk')
+        last_pk = 0
+        moved = missing = deleted = 0
+        while True:
+            posts = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not posts:
+                break
+            last_pk = posts[-1].pk
+            old_names = set()
+            for post in posts:
+                old_name = post.image.name
+                if self.storage.is_hashed_name(old_name):
+                    continue
+                if options['dry_run']:
+                    moved += 1
+                    continue
+                new_name = self.move(old_name)
+                if new_name is None:
+                    missing += 1
+                    continue
+                Post.objects.filter(pk=post.pk).update(
+                    image=new_name, updated=timezone.now()
+                )
+                bump_post_scopes(post.author_id, post.group_id,
+                                 post_id=post.pk)
+                # update() обходит post_save: миниатюры под новое имя
+                # ставятся в очередь здесь, иначе шаблоны покажут заглушку.
+                post.image = new_name
+                thumbnails.queue(post.image)
+                old_names.add(old_name)
+                moved += 1
+            if options['delete_old']:
+                deleted += self.delete_unused(old_names)
+            self.stdout.write(
+                f'Перенесено картинок: {moved}, файлов не найдено: {missing}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: перенесено {moved}, удалено старых файлов {deleted}'
+        ))
+
+    def move(self, old_name):
+        # Одинаковые файлы сохраняются одним: если копия с тем же
+        # хешем уже есть, storage.save просто вернёт её имя.
+        try:
+            with self.storage.open(old_name) as old_file:
+                return self.storage.save(old_name, File(old_file))
+        except (OSError, SuspiciousFileOperation):
+            return None
+
+    def delete_unused(self, old_names):
+        used = set(Post.objects.filter(image__in=old_names)
+                   .values_list('image', flat=True))
+        unused = old_names - used
+        for old_name in unused:
+            # Удаляет файл, его запись в kvstore sorl и миниатюры.
+            thumbnail.delete(thumbnails.get_source(old_name))
+        return len(unused)
@@ -0,0 +1,404 @@
+import contextlib
+import csv
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import cache_versions, counters, tags, timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+KINDS = ('user', 'group', 'post', 'comment', 'follow')
+FORMATS = ('jsonl', 'csv')
+# Предел числа параметров в одном запросе SQLite.
+MAX_VARIABLES = 500
+
+
+class IdMap:
+    """Соответствие id исходной системы первичным ключам базы.
+
+    Хранится в файле SQLite, а не в словаре, поэтому память не растёт
+    с размером выгрузки. Файл можно передавать следующим запускам:
+    уже загруженные записи пропускаются, а ссылки на них разрешаются.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS id_map (kind TEXT, source TEXT, '
+            'pk INTEGER, PRIMARY KEY (kind, source)) WITHOUT ROWID'
+        )
+
+    def get_many(self, kind, sources):
+        sources = list({str(source) for source in sources if source})
+        found = {}
+        for start in range(0, len(sources), MAX_VARIABLES):
+            chunk = sources[start:start + MAX_VARIABLES]
+            found.update(self.db.execute(
+                'SELECT source, pk FROM id_map WHERE kind = ? AND source IN '
+                f'({", ".join("?" * len(chunk))})', [kind, *chunk]
+            ))
+        return found
+
+    def add_many(self, kind, pairs):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO id_map VALUES (?, ?, ?)',
+                ((kind, str(source), pk) for source, pk in pairs)
+            )
+
+    def close(self):
+        self.db.close()
+
+
+@contextlib.contextmanager
+def keep_dates(*fields):
+    """bulk_create проставил бы полям auto_now_add текущее время,
+    а у импортируемых записей есть свои даты."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def read_records(path, data_format, kind):
+    """Записи файла по одной, не читая его целиком.
+
+    В JSONL тип записи берётся из поля type, в CSV - из --type.
+    """
+    if path == '-':
+        file = contextlib.nullcontext(sys.stdin)
+    else:
+        file = open(path, newline='', encoding='utf-8')
+    with file as lines:
+        if data_format == 'csv':
+            for record in csv.DictReader(lines):
+                yield kind, record
+            return
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                raise CommandError(f'{path}:{number}: {error}')
+            yield record.pop('type', kind), record
+
+
+class Command(BaseCommand):
+    help = ('Загружает пользователей, группы, посты, комментарии и подписки '
+            'из JSONL или CSV потоком, порциями через bulk_create. '
+            'Записи должны идти после тех, на которые они ссылаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+',
+            help='Файлы выгрузки, - для стандартного ввода.'
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS, dest='data_format',
+            help='Формат файлов. По умолчанию определяется по расширению.'
+        )
+        parser.add_argument(
+            '--type', choices=KINDS, dest='kind',
+            help='Тип записей для CSV и для строк JSONL без поля type.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько записей загружать в одной транзакции.'
+        )
+        parser.add_argument(
+            '--id-map',
+            help='Файл соответствия id. С ним импорт можно продолжить '
+                 'или загрузить связанные данные следующим запуском.'
+        )
+        parser.add_argument(
+            '--no-repair', action='store_true',
+            help='Не пересчитывать счётчики, ленты, теги и данные '
+                 'картинок загруженных записей.'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.loaded = dict.fromkeys(KINDS, 0)
+        self.skipped = 0
+        self.last_pks = {}
+        self.has_images = False
+        # Записи этого запуска получат ключи больше нынешних: по ним
+        # после загрузки находится всё, что нужно досчитать.
+        self.start_pks = {
+            model: model.objects.aggregate(last=Max('pk'))['last'] or 0
+            for model in (Post, Comment, Follow)
+        }
+        started = time.monotonic()
+        with contextlib.ExitStack() as stack:
+            id_map_path = options['id_map']
+            if not id_map_path:
+                directory = stack.enter_context(tempfile.TemporaryDirectory())
+                id_map_path = os.path.join(directory, 'id_map.sqlite3')
+            self.id_map = IdMap(id_map_path)
+            stack.callback(self.id_map.close)
+            stack.enter_context(keep_dates(
+                Post._meta.get_field('pub_date'),
+                Comment._meta.get_field('created'),
+            ))
+            for path in options['paths']:
+                self.import_file(path, started)
+        self.reset_sequences()
+        total = sum(self.loaded.values())
+        elapsed = time.monotonic() - started
+        if not options['no_repair'] and total:
+            self.repair()
+        self.stdout.write(self.style.SUCCESS(
+            'Загружено: ' + ', '.join(
+                f'{kind} {count}' for kind, count in self.loaded.items()
+            ) + f'; пропущено {self.skipped}; '
+            f'{total / elapsed if elapsed else total:.0f} записей в секунду'
+        ))
+
+    def import_file(self, path, started):
+        data_format = self.options['data_format']
+        if data_format is None:
+            data_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        if data_format == 'csv' and not self.options['kind']:
+            raise CommandError('Для CSV нужно указать --type')
+        kind, batch = None, []
+        records = read_records(path, data_format, self.options['kind'])
+        for record_kind, record in records:
+            if record_kind not in KINDS:
+                raise CommandError(f'{path}: неизвестный тип {record_kind}')
+            # Порция содержит записи одного типа: следующие записи могут
+            # ссылаться на неё, поэтому при смене типа она загружается.
+            if batch and (record_kind != kind
+                          or len(batch) >= self.options['batch_size']):
+                self.load(kind, batch, started)
+                batch = []
+            kind = record_kind
+            batch.append(record)
+        if batch:
+            self.load(kind, batch, started)
+
+    def load(self, kind, records, started):
+        with transaction.atomic():
+            loaded, pairs = getattr(self, f'load_{kind}')(records)
+        # В карту id попадает только то, что уже записано в базу.
+        self.id_map.add_many(kind, pairs)
+        self.loaded[kind] += loaded
+        self.skipped += len(records) - loaded
+        total = sum(self.loaded.values())
+        self.stdout.write(
+            f'{kind}: загружено {self.loaded[kind]}, всего {total}, '
+            f'{total / (time.monotonic() - started):.0f} записей в секунду'
+        )
+
+    def next_pk(self, model):
+        # Ключи назначаются заранее: bulk_create в SQLite их не возвращает,
+        # а они нужны для карты id. Импорт рассчитан на то, что в это
+        # время в таблицы больше никто не пишет.
+        if model not in self.last_pks:
+            self.last_pks[model] = model.objects.aggregate(
+                last=Max('pk')
+            )['last'] or 0
+        self.last_pks[model] += 1
+        return self.last_pks[model]
+
+    def reset_sequences(self):
+        # После вставки с явными ключами PostgreSQL нужно сдвинуть
+        # последовательности, иначе следующий INSERT получит занятый pk.
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), list(self.last_pks)
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def unseen(self, kind, records):
+        known = self.id_map.get_many(kind, (r.get('id') for r in records))
+        return [r for r in records if str(r.get('id')) not in known]
+
+    def resolve(self, kind, records, field):
+        return self.id_map.get_many(kind, (r.get(field) for r in records))
+
+    @staticmethod
+    def parse_date(value):
+        if not value:
+            return timezone.now()
+        date = parse_datetime(value)
+        if date is None:
+            raise CommandError(f'Неверная дата: {value}')
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date, timezone.utc)
+        return date
+
+    def load_natural(self, model, key, records, build):
+        """Пользователи и группы с уже существующим username или slug
+        не создаются заново, а сопоставляются с имеющимися."""
+        records = self.unseen(model.__name__.lower(), records)
+        existing = dict(model.objects.filter(**{
+            f'{key}__in': [record[key] for record in records]
+        }).values_list(key, 'pk'))
+        objects, pairs = [], []
+        for record in records:
+            pk = existing.get(record[key])
+            if pk is None:
+                pk = existing[record[key]] = self.next_pk(model)
+                objects.append(build(pk, record))
+            pairs.append((record['id'], pk))
+        model.objects.bulk_create(objects)
+        return len(pairs), pairs
+
+    def load_user(self, records):
+        return self.load_natural(User, 'username', records, lambda pk, r: User(
+            pk=pk,
+            username=r['username'],
+            email=r.get('email') or '',
+            first_name=r.get('first_name') or '',
+            last_name=r.get('last_name') or '',
+            # Ожидается хеш пароля. Без него войти можно только
+            # после восстановления пароля.
+            password=r.get('password') or make_password(None),
+            date_joined=self.parse_date(r.get('date_joined')),
+        ))
+
+    def load_group(self, records):
+        return self.load_natural(Group, 'slug', records, lambda pk, r: Group(
+            pk=pk,
+            slug=r['slug'],
+            title=r.get('title') or r['slug'],
+            description=r.get('description') or '',
+        ))
+
+    def load_post(self, records):
+        records = self.unseen('post', records)
+        authors = self.resolve('user', records, 'author')
+        groups = self.resolve('group', records, 'group')
+        posts, pairs = [], []
+        for record in records:
+            author_id = authors.get(str(record.get('author')))
+            if author_id is None:
+                continue
+            post = Post(
+                pk=self.next_pk(Post),
+                text=record.get('text') or '',
+                author_id=author_id,
+                group_id=groups.get(str(record.get('group'))),
+                image=record.get('image') or '',
+                pub_date=self.parse_date(record.get('pub_date')),
+            )
+            self.has_images = self.has_images or bool(post.image)
+            posts.append(post)
+            pairs.append((record['id'], post.pk))
+        Post.objects.bulk_create(posts)
+        # Сигналы bulk_create не вызывает, устаревшие страницы
+        # сбрасываются здесь.
+        scopes = {'posts'}
+        for post in posts:
+            scopes.add(f'profile:{post.author_id}')
+            if post.group_id:
+                scopes.add(f'group:{post.group_id}')
+        cache_versions.bump(*scopes)
+        return len(posts), pairs
+
+    def load_comment(self, records):
+        records = self.unseen('comment', records)
+        posts = self.resolve('post', records, 'post')
+        authors = self.resolve('user', records, 'author')
+        comments, pairs = [], []
+        for record in records:
+            post_id = posts.get(str(record.get('post')))
+            author_id = authors.get(str(record.get('author')))
+            if post_id is None or author_id is None:
+                continue
+            comments.append(Comment(
+                pk=self.next_pk(Comment),
+                post_id=post_id,
+                author_id=author_id,
+                text=record.get('text') or '',
+                created=self.parse_date(record.get('created')),
+            ))
+            pairs.append((record['id'], comments[-1].pk))
+        Comment.objects.bulk_create(comments)
+        cache_versions.bump(*{f'post:{c.post_id}' for c in comments})
+        return len(comments), pairs
+
+    def load_follow(self, records):
+        users = self.resolve('user', records, 'user')
+        authors = self.resolve('user', records, 'author')
+        follows = []
+        for record in records:
+            user_id = users.get(str(record.get('user')))
+            author_id = authors.get(str(record.get('author')))
+            if user_id is None or author_id is None or user_id == author_id:
+                continue
+            follows.append(Follow(user_id=user_id, author_id=author_id))
+        # Повторные подписки молча пропускаются уникальным ограничением.
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        return len(follows), []
+
+    def batches(self, queryset):
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)
+                         .order_by('pk')[:self.options['batch_size']])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def repair(self):
+        # bulk_create обходит сигналы: счётчики, ленты, теги и данные
+        # картинок догоняются только для записей этого запуска, а не
+        # пересчётом всего сайта.
+        new_posts = Post.objects.filter(pk__gt=self.start_pks[Post])
+        new_comments = Comment.objects.filter(
+            pk__gt=self.start_pks[Comment]
+        )
+        new_follows = Follow.objects.filter(pk__gt=self.start_pks[Follow])
+        users = counters.with_actual_user_counts(User.objects.filter(
+            Q(pk__in=new_posts.values('author'))
+            | Q(pk__in=new_follows.values('user'))
+            | Q(pk__in=new_follows.values('author'))
+        ).select_related('stats'))
+        fixed_users = fixed_posts = 0
+        for batch in self.batches(users):
+            drifted = counters.drifted_user_stats(batch)
+            with transaction.atomic():
+                for stats in drifted:
+                    stats.save()
+            fixed_users += len(drifted)
+        posts = counters.with_actual_post_counts(Post.objects.filter(
+            pk__in=new_comments.values('post')
+        ).only('pk', 'comments_count'))
+        for batch in self.batches(posts):
+            drifted = counters.drifted_posts(batch)
+            Post.objects.bulk_update(drifted, ['comments_count'])
+            fixed_posts += len(drifted)
+        # Новые посты разложены по лентам при bulk_create, но посты,
+        # загруженные раньше подписки, в ленту подписчика не попали.
+        # Счётчики уже верны, так что порог знаменитостей соблюдается.
+        for batch in self.batches(new_follows.only('user', 'author')):
+            for follow in batch:
+                timeline.add_author(follow.user_id, follow.author_id)
+        for batch in self.batches(new_posts.only('pk', 'text', 'pub_date')):
+            with transaction.atomic():
+                tags.update_posts(batch)
+        self.stdout.write(f'Исправлено счётчиков: пользователей '
+                          f'{fixed_users}, постов {fixed_posts}')
+        if self.has_images:
+            call_command('fill_image_info', stdout=self.stdout,
+                         stderr=self.stderr)
@@ -0,0 +1,129 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def render(name, force, max_width):
+    try:
+        return thumbnails.render(name, force=force, max_width=max_width)
+    except Exception:
+        thumbnails.logger.exception('Не удалось создать миниатюру %s', name)
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Создаёт миниатюры картинок всех постов в пуле процессов '
+            'и записывает их в kvstore sorl-thumbnail.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько постов обрабатывать за один проход.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов, по умолчанию по числу ядер.'
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Не больше стольких картинок в секунду, 0 - без ограничения.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с id последнего обработанного поста. Если он есть, '
+                 'обход продолжается с этого места.'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать и те миниатюры, которые уже есть.'
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.rate = options['rate']
+        self.force = options['force']
+        self.checkpoint = options['checkpoint']
+        last_pk = self.read_checkpoint()
+        queryset = Post.objects.filter(image__gt='').order_by('pk')
+        total = queryset.filter(pk__gt=last_pk).count()
+        done = created = failed = 0
+        started = time.monotonic()
+        # Дочерним процессам не нужны унаследованные соединения с базой.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'],
+                                 initializer=django.setup) as executor:
+            while True:
+                batch = list(
+                    queryset.filter(pk__gt=last_pk).values_list(
+                        'pk', 'image', 'image_width'
+                    )[:self.batch_size]
+                )
+                if not batch:
+                    break
+                batch_started = time.monotonic()
+                widths = {name: width for _, name, width in batch}
+                names = self.missing(widths)
+                results = executor.map(
+                    render, names, [self.force] * len(names),
+                    [widths[name] for name in names]
+                )
+                for name, result in zip(names, results):
+                    if result is None:
+                        failed += 1
+                    else:
+                        thumbnails.store(*result)
+                        created += 1
+                last_pk = batch[-1][0]
+                self.write_checkpoint(last_pk)
+                done += len(batch)
+                self.throttle(len(names), batch_started)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Постов {done} из {total}, создано {created}, '
+                    f'ошибок {failed}, {done / elapsed:.1f} постов/с'
+                )
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: миниатюры созданы для {created} картинок, '
+            f'ошибок {failed}'
+        ))
+
+    def missing(self, widths):
+        if self.force:
+            return sorted(widths)
+        return sorted(
+            name for name, width in widths.items()
+            if any(thumbnails.lookup(name, preset, variant) is None
+                   for preset, variant, _, _ in thumbnails.get_variants(width))
+        )
+
+    def throttle(self, count, batch_started):
+        if not self.rate:
+            return
+        delay = count / self.rate - (time.monotonic() - batch_started)
+        if delay > 0:
+            time.sleep(delay)
+
+    def read_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as checkpoint:
+            return int(checkpoint.read().strip() or 0)
+
+    def write_checkpoint(self, last_pk):
+        if not self.checkpoint:
+            return
+        # Запись через временный файл, чтобы прерванный процесс
+        # не оставил обрезанное значение.
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            checkpoint.write(str(last_pk))
+        os.replace(temporary, self.checkpoint)
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+from posts.models import Post, User
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики постов, комментариев и подписок '
+            'и исправляет разошедшиеся значения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк пересчитывать в одной транзакции.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        users = self.repair_users()
+        posts = self.repair_posts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков: пользователей {users}, постов {posts}'
+        ))
+
+    def batches(self, queryset):
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)
+                         .order_by('pk')[:self.batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def repair_users(self):
+        repaired = 0
+        queryset = counters.with_actual_user_counts(
+            User.objects.select_related('stats')
+        )
+        for batch in self.batches(queryset):
+            drifted = counters.drifted_user_stats(batch)
+            repaired += len(drifted)
+            if not self.dry_run:
+                with transaction.atomic():
+                    for stats in drifted:
+                        stats.save()
+        return repaired
+
+    def repair_posts(self):
+        repaired = 0
+        queryset = counters.with_actual_post_counts(
+            Post.objects.only('pk', 'comments_count')
+        )
+        for batch in self.batches(queryset):
+            drifted = counters.drifted_posts(batch)
+            repaired += len(drifted)
+            if not self.dry_run:
+                Post.objects.bulk_update(drifted, ['comments_count'])
+        return repaired
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='trending_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Популярность посчитана'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(trending_score__gt=0), fields=['-trending_score', '-id'], name='post_trending_idx'),
+        ),
+    ]
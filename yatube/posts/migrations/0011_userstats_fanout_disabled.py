@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_related_posts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='fanout_disabled',
+            field=models.BooleanField(default=False, verbose_name='Без раскладки по лентам'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_userstats_fanout_disabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='profile_changed',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Имя изменено'),
+        ),
+    ]
@@ -20,12 +20,37 @@ class Group(models.Model):
         return str(self.title)
 
 
+class PostQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """post_save при bulk_create не отправляется, поэтому новые
+        посты раскладываются по лентам подписчиков здесь."""
+        from . import timeline
+
+        objs = list(objs)
+        pks = [post.pk for post in objs]
+        # В SQLite bulk_create не возвращает ключи: посты без
+        # заданного pk находятся по ключам больше прежнего наибольшего.
+        last_pk = None if all(pks) else (
+            self.order_by().aggregate(last=models.Max('pk'))['last'] or 0
+        )
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if last_pk is None:
+            created = Post.objects.filter(pk__in=pks)
+        else:
+            created = Post.objects.filter(
+                pk__gt=last_pk, author__in={post.author_id for post in objs}
+            )
+        timeline.fan_out_posts(created)
+        return objs
+
+
 class Post(models.Model):
     text = models.TextField(
         verbose_name='Текст',
         help_text='Напишите о чём хотели-бы рассказать'
     )
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField('Изменён', auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -48,11 +73,61 @@ class Post(models.Model):
         blank=True,
         null=True,
     )
+    # Заполняются при загрузке картинки, чтобы шаблонам и sorl
+    # не приходилось открывать файл ради его размеров.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', blank=True, null=True
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', blank=True, null=True
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер файла', blank=True, null=True
+    )
+    image_color = models.CharField(
+        'Цвет заглушки', max_length=7, blank=True
+    )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+    )
+    # Счёт в ленте «Популярное» на момент trending_at, см. posts.trending.
+    trending_score = models.FloatField('Популярность', default=0)
+    trending_at = models.DateTimeField(
+        'Популярность посчитана', blank=True, null=True
+    )
+    # Когда posts.related считал похожие посты; None - текст новый
+    # или изменён, и список нужно пересчитать.
+    related_at = models.DateTimeField(
+        'Похожие посчитаны', blank=True, null=True
+    )
+    # Заполняются из текста в posts.tags при каждом сохранении.
+    tags = models.ManyToManyField(
+        'Tag',
+        through='PostTag',
+        related_name='posts',
+        blank=True,
+        verbose_name='Теги',
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(fields=['-pub_date'], name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date'],
+                         name='post_group_date_idx'),
+            # Частичный: в индексе только посты, которые сейчас
+            # в «Популярном», остальные давно остыли до нуля.
+            models.Index(fields=['-trending_score', '-id'],
+                         name='post_trending_idx',
+                         condition=models.Q(trending_score__gt=0)),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -79,6 +154,13 @@ class Comment(models.Model):
     )
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['created']
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -97,3 +179,140 @@ class Follow(models.Model):
     class Meta:
         constraints = [models.UniqueConstraint(fields=['user', 'author'],
                                                name='unique_booking')]
+        indexes = [models.Index(fields=['author', 'user'],
+                                name='follow_author_user_idx')]
+
+
+class TimelineEntry(models.Model):
+    """Строка материализованной ленты подписок пользователя.
+
+    Заполняется при публикации поста и при подписке, чтобы лента
+    читалась одним диапазоном по индексу (user, pub_date).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор поста',
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'post'],
+                                               name='unique_timeline_post')]
+        indexes = [models.Index(fields=['user', '-pub_date', '-post'],
+                                name='timeline_user_date_idx')]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, обновляемые вместе с постами и подписками."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    # Меняется при смене имени пользователя и входит в ключ кэша
+    # карточек его постов: сами посты при этом не переписываются.
+    profile_changed = models.DateTimeField('Имя изменено', null=True,
+                                           blank=True)
+    # Посты автора хоть раз не разложились по лентам: они подмешиваются
+    # живым запросом, даже когда подписчиков стало меньше порога.
+    fanout_disabled = models.BooleanField('Без раскладки по лентам',
+                                          default=False)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class Tag(models.Model):
+    """#хештег или @упоминание, найденные в текстах постов."""
+    HASHTAG = 'hashtag'
+    MENTION = 'mention'
+    KIND_CHOICES = [
+        (HASHTAG, 'Хештег'),
+        (MENTION, 'Упоминание'),
+    ]
+    kind = models.CharField('Вид', max_length=7, choices=KIND_CHOICES)
+    # Хештеги хранятся в нижнем регистре, упоминания - как username.
+    name = models.CharField('Имя', max_length=150)
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+
+    class Meta:
+        ordering = ['-posts_count']
+        verbose_name = 'Тег'
+        verbose_name_plural = 'Теги'
+        constraints = [models.UniqueConstraint(fields=['kind', 'name'],
+                                               name='unique_tag')]
+
+    def __str__(self):
+        prefix = '#' if self.kind == self.HASHTAG else '@'
+        return f'{prefix}{self.name}'
+
+
+class PostTag(models.Model):
+    """Связь поста с тегом. Дата поста повторена здесь, чтобы лента
+    тега читалась одним диапазоном по индексу (tag, pub_date)."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='tag_links',
+        verbose_name='Пост',
+    )
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='post_links',
+        verbose_name='Тег',
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['post', 'tag'],
+                                               name='unique_post_tag')]
+        indexes = [models.Index(fields=['tag', '-pub_date', '-post'],
+                                name='post_tag_date_idx')]
+
+
+class RelatedPost(models.Model):
+    """Похожий пост по косинусу TF-IDF векторов текстов, см. posts.related.
+
+    На странице поста список читается одним диапазоном по индексу
+    (post, -score).
+    """
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='related_links',
+        verbose_name='Пост',
+    )
+    related = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий пост',
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['post', 'related'],
+                                               name='unique_related_post')]
+        indexes = [models.Index(fields=['post', '-score'],
+                                name='related_post_score_idx')]
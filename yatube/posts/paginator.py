@@ -0,0 +1,116 @@
+import base64
+import binascii
+import collections.abc
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, date, pk):
+    raw = f'{direction}|{date.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (направление, дата, id) или None для битого курсора."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, date, pk = raw.decode().split('|')
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or date is None:
+        return None
+    return direction, date, pk
+
+
+class CursorPaginator:
+    """Паджинатор по ключу (pub_date, id) без COUNT(*) и OFFSET.
+
+    Каждая страница - это один индексный поиск от позиции курсора,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+    """
+
+    def __init__(self, object_list, per_page,
+                 date_field='pub_date', id_field='pk'):
+        self.per_page = int(per_page)
+        self.object_list = object_list.annotate(
+            cursor_date=F(date_field),
+            cursor_id=F(id_field),
+        )
+
+    def get_page(self, cursor=None):
+        position = decode_cursor(cursor) if cursor else None
+        queryset = self.object_list
+        if position is None:
+            direction = NEXT
+            queryset = queryset.order_by('-cursor_date', '-cursor_id')
+        else:
+            direction, date, pk = position
+            if direction == NEXT:
+                queryset = queryset.filter(
+                    Q(cursor_date__lt=date)
+                    | Q(cursor_date=date, cursor_id__lt=pk)
+                ).order_by('-cursor_date', '-cursor_id')
+            else:
+                queryset = queryset.filter(
+                    Q(cursor_date__gt=date)
+                    | Q(cursor_date=date, cursor_id__gt=pk)
+                ).order_by('cursor_date', 'cursor_id')
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == PREVIOUS:
+            rows.reverse()
+            return CursorPage(rows, self, cursor,
+                              has_next=True, has_previous=has_more)
+        return CursorPage(rows, self, cursor,
+                          has_next=has_more, has_previous=position is not None)
+
+
+class CursorPage(collections.abc.Sequence):
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, cursor,
+                 has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor or ''
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __repr__(self):
+        return f'<CursorPage {self.cursor or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(NEXT, last.cursor_date, last.cursor_id)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        first = self.object_list[0]
+        return encode_cursor(PREVIOUS, first.cursor_date, first.cursor_id)
@@ -0,0 +1,213 @@
+import re
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from . import cache_versions
+from .models import Post, RelatedPost
+
+# numpy и scipy импортируются внутри функций расчёта: веб-процессам,
+# которые только читают RelatedPost, они не нужны.
+BATCH_SIZE = 1000
+WORD_RE = re.compile(r'\w+')
+# Короткие слова - в основном предлоги и союзы.
+MIN_WORD_LENGTH = 3
+
+
+def tokenize(text):
+    words = WORD_RE.findall(text.casefold().replace('ё', 'е'))
+    return [word for word in words
+            if len(word) >= MIN_WORD_LENGTH and not word.isdigit()]
+
+
+def vectorize(rows):
+    """TF-IDF матрица по строкам (pk, текст), упорядоченным по pk.
+
+    Возвращает (массив pk, CSR-матрица со строками единичной длины).
+    Слово из одного поста ни с чем его не связывает, а слово больше
+    чем из RELATED_MAX_DF доли постов связывает всё со всем: такие
+    слова в векторы не попадают.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    pks = array('q')
+    indptr = array('q', [0])
+    indices = array('i')
+    counts = array('f')
+    vocabulary = {}
+    for pk, text in rows:
+        terms = Counter(vocabulary.setdefault(word, len(vocabulary))
+                        for word in tokenize(text))
+        pks.append(pk)
+        indices.extend(terms.keys())
+        counts.extend(terms.values())
+        indptr.append(len(indices))
+    size = len(pks)
+    matrix = sparse.csr_matrix(
+        (np.array(counts, dtype=np.float32),
+         np.array(indices, dtype=np.int32),
+         np.array(indptr, dtype=np.int64)),
+        shape=(size, len(vocabulary)),
+    )
+    frequency = np.bincount(matrix.indices, minlength=len(vocabulary))
+    useful = (frequency >= 2) & (frequency <= settings.RELATED_MAX_DF * size)
+    idf = np.where(useful, np.log((1 + size) / (1 + frequency)) + 1,
+                   0).astype(np.float32)
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags((1 / norms).astype(np.float32)) @ matrix
+    return np.array(pks, dtype=np.int64), matrix.tocsr()
+
+
+def similarity_blocks(matrix, rows, block_size):
+    """Косинусная близость строк rows со всеми строками матрицы,
+    по block_size строк за одно умножение. Даёт (строки, CSR-блок)."""
+    transposed = matrix.T.tocsc()
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        yield block, (matrix[block] @ transposed).tocsr()
+
+
+def top(columns, scores, pks, limit):
+    """limit лучших соседей: по убыванию сходства, при равенстве -
+    более новые посты."""
+    import numpy as np
+
+    if len(scores) > limit:
+        best = np.argpartition(-scores, limit)[:limit]
+        columns, scores = columns[best], scores[best]
+    order = np.lexsort((-pks[columns], -scores))
+    return [(int(pks[column]), float(score))
+            for column, score in zip(columns[order], scores[order])]
+
+
+def neighbour_thresholds(pks):
+    """Сходство, которое нужно превзойти, чтобы попасть в уже
+    посчитанный список каждого поста: худшее в полном списке или
+    RELATED_MIN_SCORE, если список короче RELATED_POSTS_COUNT."""
+    import numpy as np
+
+    thresholds = np.full(len(pks), settings.RELATED_MIN_SCORE,
+                         dtype=np.float32)
+    full = RelatedPost.objects.values('post').annotate(
+        total=Count('pk'), worst=Min('score')
+    ).filter(total__gte=settings.RELATED_POSTS_COUNT).values_list(
+        'post', 'worst'
+    )
+    for pk, worst in full.iterator(chunk_size=BATCH_SIZE):
+        position = np.searchsorted(pks, pk)
+        if position < len(pks) and pks[position] == pk:
+            thresholds[position] = max(worst, settings.RELATED_MIN_SCORE)
+    return thresholds
+
+
+def update(full=False, block_size=None):
+    """Пересчитывает похожие посты для новых и изменённых постов.
+
+    Для них соседи ищутся по всем постам. Заодно новые посты попадают
+    в уже посчитанные списки старых, если оказались ближе их худшего
+    соседа. Веса слов при этом меняются для всех, поэтому старые списки
+    понемногу устаревают; full пересчитывает все списки заново.
+    Возвращает (пересчитано постов, дополнено чужих списков).
+    """
+    import numpy as np
+
+    started = timezone.now()
+    stale = Post.objects.all()
+    if not full:
+        stale = stale.filter(related_at__isnull=True)
+    stale = list(stale.values_list('pk', flat=True))
+    if not stale:
+        return 0, 0
+    pks, matrix = vectorize(
+        Post.objects.order_by('pk').values_list('pk', 'text').iterator(
+            chunk_size=BATCH_SIZE
+        )
+    )
+    is_stale = np.isin(pks, stale)
+    rows = np.flatnonzero(is_stale)
+    thresholds = None if full else neighbour_thresholds(pks)
+    limit = settings.RELATED_POSTS_COUNT
+    lists = {}
+    candidates = defaultdict(list)
+    for block, similarity in similarity_blocks(
+        matrix, rows, block_size or settings.RELATED_BLOCK_SIZE
+    ):
+        for offset, row in enumerate(block):
+            start, end = similarity.indptr[offset:offset + 2]
+            columns = similarity.indices[start:end]
+            scores = similarity.data[start:end]
+            keep = (columns != row) & (scores >= settings.RELATED_MIN_SCORE)
+            lists[int(pks[row])] = top(columns[keep], scores[keep], pks,
+                                       limit)
+        if thresholds is None:
+            continue
+        found = similarity.tocoo()
+        keep = ((found.data > thresholds[found.col])
+                & ~is_stale[found.col] & (block[found.row] != found.col))
+        for row, column, score in zip(block[found.row[keep]],
+                                      found.col[keep], found.data[keep]):
+            candidates[int(pks[column])].append((int(pks[row]),
+                                                 float(score)))
+    extended = merge_candidates(candidates, set(lists), limit)
+    lists.update(extended)
+    store(lists)
+    for start in range(0, len(stale), BATCH_SIZE):
+        # Пост, изменённый во время расчёта, остаётся в очереди.
+        Post.objects.filter(
+            pk__in=stale[start:start + BATCH_SIZE], updated__lte=started
+        ).update(related_at=started)
+    return len(lists) - len(extended), len(extended)
+
+
+def merge_candidates(candidates, stale, limit):
+    """Новые списки постов, в которые попали пересчитанные посты."""
+    merged = {}
+    pks = list(candidates)
+    for start in range(0, len(pks), BATCH_SIZE):
+        chunk = pks[start:start + BATCH_SIZE]
+        current = defaultdict(list)
+        for post_id, related_id, score in RelatedPost.objects.filter(
+            post__in=chunk
+        ).values_list('post', 'related', 'score'):
+            # Сходство с пересчитанным постом берётся свежее.
+            if related_id not in stale:
+                current[post_id].append((related_id, score))
+        for pk in chunk:
+            neighbours = current[pk] + candidates[pk]
+            neighbours.sort(key=lambda item: (-item[1], -item[0]))
+            merged[pk] = neighbours[:limit]
+    return merged
+
+
+def store(lists):
+    pks = list(lists)
+    for start in range(0, len(pks), BATCH_SIZE):
+        chunk = pks[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            RelatedPost.objects.filter(post__in=chunk).delete()
+            # Пост мог быть удалён, пока шёл расчёт.
+            existing = set(Post.objects.filter(
+                pk__in={related_id for pk in chunk
+                        for related_id, _ in lists[pk]} | set(chunk)
+            ).values_list('pk', flat=True))
+            RelatedPost.objects.bulk_create(
+                RelatedPost(post_id=pk, related_id=related_id, score=score)
+                for pk in chunk if pk in existing
+                for related_id, score in lists[pk] if related_id in existing
+            )
+        cache_versions.bump(*(f'post:{pk}' for pk in chunk))
+
+
+def related_posts(post):
+    """Похожие посты для страницы поста: один запрос по индексу."""
+    return Post.objects.filter(similar_to__post=post).select_related(
+        'author'
+    ).order_by('-similar_to__score')[:settings.RELATED_POSTS_COUNT]
@@ -0,0 +1,219 @@
+import base64
+import binascii
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Substr
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .paginator import NEXT, PREVIOUS, CursorPage
+
+POST_TABLE = Post._meta.db_table
+FTS_TABLE = f'{POST_TABLE}_fts'
+TRIGGERS = {
+    f'{FTS_TABLE}_insert': (
+        f'AFTER INSERT ON {POST_TABLE} BEGIN '
+        f'INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); '
+        f'END'
+    ),
+    f'{FTS_TABLE}_delete': (
+        f'AFTER DELETE ON {POST_TABLE} BEGIN '
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) '
+        f"VALUES ('delete', old.id, old.text); "
+        f'END'
+    ),
+    f'{FTS_TABLE}_update': (
+        f'AFTER UPDATE OF text ON {POST_TABLE} BEGIN '
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) '
+        f"VALUES ('delete', old.id, old.text); "
+        f'INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); '
+        f'END'
+    ),
+}
+RANK = f'bm25({FTS_TABLE})'
+# Совпадения в сниппете размечаются управляющими символами, которых
+# нет в тексте постов, и заменяются на <mark> уже после экранирования.
+MARK_START, MARK_END = '\x02', '\x03'
+SNIPPET = f"snippet({FTS_TABLE}, 0, char(2), char(3), '…', 16)"
+SNIPPET_LENGTH = 200
+WORD_RE = re.compile(r'\w+')
+
+
+def is_supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install(using=connection):
+    """Создаёт индекс FTS5 по Post.text и триггеры, которые держат его
+    в согласии с таблицей постов при любых INSERT, UPDATE и DELETE,
+    в том числе из bulk_create и QuerySet.update.
+
+    SQLite пересоздаёт таблицу при изменении её схемы в миграциях,
+    и триггеры пропадают вместе со старой таблицей. Поэтому функция
+    вызывается после каждого migrate и, если триггеров не было,
+    перестраивает индекс целиком.
+    """
+    if (not is_supported(using)
+            or POST_TABLE not in using.introspection.table_names()):
+        return
+    with using.cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            f"text, content='{POST_TABLE}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            'AND tbl_name = %s', [POST_TABLE]
+        )
+        existing = {name for name, in cursor.fetchall()}
+        missing = set(TRIGGERS) - existing
+        for name in missing:
+            cursor.execute(f'CREATE TRIGGER {name} {TRIGGERS[name]}')
+        if missing:
+            rebuild(cursor)
+
+
+def rebuild(cursor):
+    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall(using=connection):
+    if not is_supported(using):
+        return
+    with using.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def build_query(text):
+    """Запрос FTS5 из текста пользователя.
+
+    Синтаксис FTS5 наружу не выставляется: каждое слово берётся
+    в кавычки и ищется по префиксу, чтобы «кот» находил «коты».
+    Слова объединяются через И. Для текста без слов возвращает None.
+    """
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search(text, queryset=None):
+    """Посты, подходящие под запрос, с полями rank и snippet.
+
+    rank - оценка BM25, чем меньше, тем релевантнее. Без FTS5
+    поиск сводится к icontains, а rank у всех результатов равен нулю.
+    """
+    queryset = Post.objects.all() if queryset is None else queryset
+    match = build_query(text)
+    if match is None:
+        return queryset.none()
+    if not is_supported():
+        return queryset.filter(text__icontains=text.strip()).annotate(
+            rank=Value(0.0, output_field=FloatField()),
+            snippet=Substr('text', 1, SNIPPET_LENGTH),
+        )
+    return queryset.extra(
+        select={'rank': RANK, 'snippet': SNIPPET},
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {POST_TABLE}.id',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+    )
+
+
+def matching_ids(text):
+    """Подзапрос id постов по запросу, для фильтра pk__in."""
+    match = build_query(text)
+    if match is None or not is_supported():
+        return None
+    return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} '
+                  f'MATCH %s', [match])
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(MARK_START, '<mark>')
+                     .replace(MARK_END, '</mark>'))
+
+
+def encode_cursor(direction, rank, pk):
+    raw = f'{direction}|{rank!r}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, rank, pk = raw.decode().split('|')
+        rank = float(rank)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS):
+        return None
+    return direction, rank, pk
+
+
+class SearchPaginator:
+    """Паджинатор результатов поиска по ключу (rank, id).
+
+    Как и CursorPaginator, не считает COUNT(*) и не пропускает строки
+    через OFFSET. Ранги зависят от всего индекса, поэтому если между
+    запросами страниц посты добавились, порядок может немного сдвинуться.
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    def get_page(self, cursor=None):
+        position = decode_cursor(cursor) if cursor else None
+        queryset = self.object_list
+        rank = RANK if is_supported() else '0'
+        if position is None:
+            direction = NEXT
+            queryset = queryset.order_by('rank', 'pk')
+        else:
+            direction, value, pk = position
+            if direction == NEXT:
+                condition, ordering = '>', ('rank', 'pk')
+            else:
+                condition, ordering = '<', ('-rank', '-pk')
+            queryset = queryset.extra(
+                where=[f'({rank} {condition} %s OR ({rank} = %s '
+                       f'AND {POST_TABLE}.id {condition} %s))'],
+                params=[value, value, pk],
+            ).order_by(*ordering)
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        for post in rows:
+            post.snippet_html = highlight(post.snippet)
+        if direction == PREVIOUS:
+            rows.reverse()
+            return SearchPage(rows, self, cursor,
+                              has_next=True, has_previous=has_more)
+        return SearchPage(rows, self, cursor,
+                          has_next=has_more, has_previous=position is not None)
+
+
+class SearchPage(CursorPage):
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(NEXT, last.rank, last.pk)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        first = self.object_list[0]
+        return encode_cursor(PREVIOUS, first.rank, first.pk)
@@ -0,0 +1,210 @@
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import (cache_versions, counters, images, search, tags, thumbnails,
+               timeline, trending)
+from .autocomplete import autocomplete
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def bump_post_scopes(author_id, *group_ids, post_id=None):
+    scopes = ['posts', f'profile:{author_id}']
+    scopes += [f'group:{group_id}' for group_id in group_ids if group_id]
+    if post_id is not None:
+        scopes.append(f'post:{post_id}')
+    cache_versions.bump(*scopes)
+
+
+# Поля пользователя, которые показывают карточки его постов.
+CARD_USER_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def remember_old_names(sender, instance, raw=False, update_fields=None,
+                       **kwargs):
+    if raw or instance.pk is None:
+        return
+    if update_fields is None or set(update_fields) & set(CARD_USER_FIELDS):
+        instance.old_names = User.objects.filter(pk=instance.pk).values_list(
+            *CARD_USER_FIELDS
+        ).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    if raw:
+        return
+    if update_fields != frozenset({'last_login'}):
+        transaction.on_commit(lambda: autocomplete.user_changed(instance))
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+        return
+    names = tuple(getattr(instance, field) for field in CARD_USER_FIELDS)
+    old_names = getattr(instance, 'old_names', names)
+    instance.old_names = names
+    if names == old_names:
+        return
+    # Карточки постов в ключе кэша несут отметку из UserStats:
+    # одна строка вместо UPDATE всех постов автора.
+    UserStats.objects.filter(user=instance).update(
+        profile_changed=timezone.now()
+    )
+    groups = instance.posts.exclude(group=None).values_list(
+        'group_id', flat=True
+    ).distinct()
+    bump_post_scopes(instance.pk, *groups)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete.removed('user', instance.pk))
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        old = Post.objects.filter(pk=instance.pk).values(
+            'group_id', 'image', 'text'
+        ).first() or {}
+        instance.old_group_id = old.get('group_id')
+        instance.old_image = old.get('image')
+        instance.old_text = old.get('text')
+
+
+@receiver(pre_save, sender=Post)
+def mark_related_stale(sender, instance, raw=False, **kwargs):
+    # build_related_posts пересчитывает похожие только для новых
+    # и изменённых текстов.
+    if not raw and instance.text != getattr(instance, 'old_text', None):
+        instance.related_at = None
+
+
+@receiver(pre_save, sender=Post)
+def read_uploaded_image(sender, instance, raw=False, **kwargs):
+    # Файл только что загружен и ещё в памяти или во временном файле:
+    # размеры дешевле прочитать сейчас, чем потом открывать его с диска.
+    if raw:
+        return
+    if not instance.image or not instance.image._committed:
+        images.fill_image_info(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_post_scopes(instance.author_id, instance.group_id,
+                     getattr(instance, 'old_group_id', None),
+                     post_id=instance.pk)
+    if instance.image.name != getattr(instance, 'old_image', None):
+        thumbnails.queue(instance.image)
+    if instance.text != getattr(instance, 'old_text', None):
+        tags.update_posts([instance])
+    if created:
+        counters.bump_user(instance.author_id, 'posts_count', 1)
+        timeline.fan_out_post(instance)
+        trending.post_created(instance)
+
+
+@receiver(thumbnails.thumbnails_ready)
+def post_thumbnails_ready(sender, name, **kwargs):
+    # Карточки с заглушкой вместо картинки нужно перерисовать.
+    posts = Post.objects.filter(image=name)
+    posts.update(updated=timezone.now())
+    for author_id, group_id, pk in posts.values_list(
+        'author_id', 'group_id', 'pk'
+    ):
+        bump_post_scopes(author_id, group_id, post_id=pk)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    tags.post_deleted(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_post_scopes(instance.author_id, instance.group_id,
+                     post_id=instance.pk)
+    counters.bump_user(instance.author_id, 'posts_count', -1)
+
+
+def bump_comment_scopes(comment):
+    post = Post.objects.filter(pk=comment.post_id).values(
+        'author_id', 'group_id'
+    ).first()
+    if post is not None:
+        bump_post_scopes(post['author_id'], post['group_id'],
+                         post_id=comment.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_comment_scopes(instance)
+    if created:
+        counters.bump_post_comments(instance.post_id, 1)
+        trending.comment_added(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump_comment_scopes(instance)
+    counters.bump_post_comments(instance.post_id, -1)
+    trending.comment_removed(instance)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.group_posts.update(updated=timezone.now())
+        cache_versions.bump('posts', f'group:{instance.pk}')
+        transaction.on_commit(lambda: autocomplete.group_changed(instance))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    instance.group_posts.update(updated=timezone.now())
+    authors = instance.group_posts.values_list(
+        'author_id', flat=True
+    ).distinct()
+    cache_versions.bump(
+        'posts',
+        f'group:{instance.pk}',
+        *(f'profile:{author_id}' for author_id in authors)
+    )
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.removed('group', pk))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        cache_versions.bump(f'follow:{instance.user_id}',
+                            f'profile:{instance.author_id}',
+                            f'profile:{instance.user_id}')
+        counters.bump_user(instance.author_id, 'followers_count', 1)
+        counters.bump_user(instance.user_id, 'following_count', 1)
+        timeline.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    cache_versions.bump(f'follow:{instance.user_id}',
+                        f'profile:{instance.author_id}',
+                        f'profile:{instance.user_id}')
+    counters.bump_user(instance.author_id, 'followers_count', -1)
+    counters.bump_user(instance.user_id, 'following_count', -1)
+    timeline.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    # Миграции SQLite, пересоздающие таблицу постов, теряют триггеры.
+    if sender.name == 'posts':
+        search.install(connections[using])
@@ -0,0 +1,189 @@
+import re
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
+
+from .models import PostTag, Tag, User
+
+BATCH_SIZE = 1000
+NAME_LENGTH = Tag._meta.get_field('name').max_length
+# Хештег - слово после #, в котором есть хотя бы одна буква: «#1»
+# в «пункт #1» тегом не считается.
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w*[^\W\d]\w*)')
+# Упоминание - username после @. Точка в конце - это конец
+# предложения, а не часть имени; e-mail адрес упоминанием не считается.
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]*\w)')
+LINK_RE = re.compile(r'(?<![\w#])#(?P<hashtag>\w*[^\W\d]\w*)'
+                     r'|(?<![\w@])@(?P<mention>[\w.+-]*\w)')
+
+
+def extract(text):
+    """Множества хештегов и упоминаний в тексте поста."""
+    hashtags = {name.casefold() for name in HASHTAG_RE.findall(text)
+                if len(name) <= NAME_LENGTH}
+    mentions = {name for name in MENTION_RE.findall(text)
+                if len(name) <= NAME_LENGTH}
+    return hashtags, mentions
+
+
+def existing_users(names):
+    """Имена из names, под которыми есть пользователи: одним запросом."""
+    if not names:
+        return set()
+    return set(User.objects.filter(
+        username__in=names
+    ).values_list('username', flat=True))
+
+
+def post_keys(posts):
+    """Ключи (вид, имя) тегов каждого поста.
+
+    Упоминания несуществующих пользователей не индексируются:
+    имена проверяются одним запросом на всю пачку постов.
+    """
+    found = {post.pk: extract(post.text) for post in posts}
+    existing = existing_users(
+        set().union(*(mentions for _, mentions in found.values()))
+    )
+    return {
+        pk: ({(Tag.HASHTAG, name) for name in hashtags}
+             | {(Tag.MENTION, name) for name in mentions & existing})
+        for pk, (hashtags, mentions) in found.items()
+    }
+
+
+def _fetch(keys):
+    names = defaultdict(set)
+    for kind, name in keys:
+        names[kind].add(name)
+    query = Q()
+    for kind, kind_names in names.items():
+        query |= Q(kind=kind, name__in=kind_names)
+    return {
+        (kind, name): pk
+        for pk, kind, name in Tag.objects.filter(query).values_list(
+            'pk', 'kind', 'name'
+        )
+    }
+
+
+def resolve(keys):
+    """id тегов по ключам (вид, имя); недостающие теги создаются."""
+    if not keys:
+        return {}
+    tag_ids = _fetch(keys)
+    missing = set(keys) - set(tag_ids)
+    if missing:
+        # Тот же тег может одновременно создавать другой запрос.
+        Tag.objects.bulk_create(
+            [Tag(kind=kind, name=name) for kind, name in missing],
+            ignore_conflicts=True,
+        )
+        tag_ids.update(_fetch(missing))
+    return tag_ids
+
+
+def bump_counts(deltas):
+    """Сдвигает posts_count тегов: по UPDATE на каждую величину сдвига."""
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(
+            posts_count=F('posts_count') + delta
+        )
+
+
+def update_posts(posts):
+    """Приводит связи постов с тегами в соответствие их текстам.
+
+    Меняются только разошедшиеся строки PostTag, счётчики тегов
+    сдвигаются на разницу. Возвращает id затронутых тегов.
+    """
+    posts = list(posts)
+    if not posts:
+        return set()
+    keys = post_keys(posts)
+    tag_ids = resolve(set().union(*keys.values()))
+    wanted = {pk: {tag_ids[key] for key in post_tags}
+              for pk, post_tags in keys.items()}
+    current = defaultdict(set)
+    for post_id, tag_id in PostTag.objects.filter(
+        post__in=list(wanted)
+    ).values_list('post_id', 'tag_id'):
+        current[post_id].add(tag_id)
+    deltas = Counter()
+    added = []
+    removed = Q()
+    for post in posts:
+        for tag_id in wanted[post.pk] - current[post.pk]:
+            added.append(PostTag(post_id=post.pk, tag_id=tag_id,
+                                 pub_date=post.pub_date))
+            deltas[tag_id] += 1
+        for tag_id in current[post.pk] - wanted[post.pk]:
+            removed |= Q(post_id=post.pk, tag_id=tag_id)
+            deltas[tag_id] -= 1
+    if removed:
+        PostTag.objects.filter(removed).delete()
+    PostTag.objects.bulk_create(added, batch_size=BATCH_SIZE)
+    bump_counts(deltas)
+    return set(deltas)
+
+
+def post_deleted(post):
+    """Вычитает удаляемый пост из счётчиков его тегов. Сами связи
+    удалит каскад."""
+    Tag.objects.filter(post_links__post=post).update(
+        posts_count=F('posts_count') - 1
+    )
+
+
+def recount():
+    """Пересчитывает posts_count всех тегов и удаляет теги без постов.
+    Возвращает (исправлено, удалено)."""
+    actual = PostTag.objects.filter(tag=OuterRef('pk')).order_by().values(
+        'tag'
+    ).annotate(total=Count('pk')).values('total')
+    drifted = Tag.objects.annotate(
+        actual=Coalesce(Subquery(actual), 0)
+    ).exclude(posts_count=F('actual'))
+    fixed = drifted.count()
+    Tag.objects.filter(pk__in=drifted.values('pk')).update(
+        posts_count=Coalesce(Subquery(actual), 0)
+    )
+    deleted, _ = Tag.objects.filter(posts_count=0).delete()
+    return fixed, deleted
+
+
+def linkify(text):
+    """Экранированный текст поста со ссылками на ленты тегов.
+
+    Как и в post_keys, ссылкой становится только упоминание
+    существующего пользователя.
+    """
+    existing = existing_users(extract(text)[1])
+
+    def link(match):
+        hashtag, mention = match.group('hashtag', 'mention')
+        if (len(hashtag or mention) > NAME_LENGTH
+                or mention and mention not in existing):
+            return escape(match.group(0))
+        if hashtag:
+            url = reverse('posts:tag_posts', args=[hashtag.casefold()])
+        else:
+            url = reverse('posts:mention_posts', args=[mention])
+        return format_html('<a href="{}">{}</a>', url, match.group(0))
+
+    parts = []
+    position = 0
+    for match in LINK_RE.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        parts.append(link(match))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return mark_safe(''.join(parts))
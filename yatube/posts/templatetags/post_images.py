@@ -0,0 +1,30 @@
+from django import template
+from django.utils.html import format_html
+
+from .. import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(image, preset='card'):
+    """Готовая миниатюра или None. Миниатюры ставятся в очередь при
+    сохранении поста, запрос только читает kvstore."""
+    if not image:
+        return None
+    return thumbnails.lookup(image, preset)
+
+
+@register.simple_tag
+def thumbnail_srcset(image, preset='card'):
+    """Атрибуты srcset и sizes из уже готовых вариантов миниатюры."""
+    if not image:
+        return ''
+    ready, _ = thumbnails.lookup_variants(image, preset)
+    if not ready:
+        return ''
+    return format_html(
+        'srcset="{}" sizes="{}"',
+        ', '.join(f'{thumbnail.url} {width}w' for width, thumbnail in ready),
+        thumbnails.PRESETS[preset]['sizes'],
+    )
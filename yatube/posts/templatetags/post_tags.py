@@ -0,0 +1,12 @@
+from django import template
+
+from .. import tags
+
+register = template.Library()
+
+
+@register.filter(is_safe=True)
+def linkify_tags(text):
+    """Текст поста с #хештегами и @упоминаниями в виде ссылок на их
+    ленты. Остальной текст экранируется."""
+    return tags.linkify(text)
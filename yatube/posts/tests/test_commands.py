@@ -0,0 +1,393 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import default
+
+from core import tasks
+
+from .. import related, thumbnails
+from ..management.commands.bench_images import make_photo
+from ..models import (Comment, Follow, Group, Post, PostTag, RelatedPost,
+                      Tag, TimelineEntry, User, UserStats)
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+class BenchIndexesTest(TestCase):
+    def test_bench_indexes_rolls_back(self):
+        """Бенчмарк индексов печатает планы и не оставляет данных"""
+
+        out = StringIO()
+        call_command('bench_indexes', posts=30, users=5, groups=2,
+                     comments=10, follows=5, repeat=1, stdout=out)
+        self.assertIn('post_author_date_idx', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+
+
+class BenchImagesTest(TestCase):
+    def test_bench_images(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as photo:
+            photo.write(make_photo((600, 400)))
+            photo.flush()
+            out = StringIO()
+            call_command('bench_images', photo.name, repeat=1,
+                         formats=['JPEG'], stdout=out)
+        self.assertIn('JPEG  сэкономлено', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RebuildThumbnailsTest(TestCase):
+    small_gif = (
+        b'\x47\x49\x46\x38\x39\x61\x02\x00'
+        b'\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+        b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+        b'\x0A\x00\x3B'
+    )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rebuild_thumbnails(self):
+        """Команда создаёт миниатюры в kvstore, пропускает готовые
+        и продолжает обход с сохранённого места"""
+
+        author = User.objects.create(username='photographer')
+        posts = [
+            Post.objects.create(
+                text=f'Пост {i}',
+                author=author,
+                image=SimpleUploadedFile(
+                    name=f'rebuild{i}.gif',
+                    # Разное содержимое, иначе хранилище склеит файлы.
+                    content=self.small_gif + bytes([i]),
+                    content_type='image/gif'
+                ),
+            )
+            for i in range(3)
+        ]
+        missing = Post.objects.create(text='Без файла', author=author,
+                                      image='posts/missing.gif')
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'checkpoint')
+        with open(checkpoint, 'w') as file:
+            file.write(str(posts[0].pk))
+
+        out = StringIO()
+        call_command('rebuild_thumbnails', workers=1, batch_size=2,
+                     checkpoint=checkpoint, stdout=out)
+        self.assertIn('создано 2', out.getvalue())
+        self.assertIn('ошибок 1', out.getvalue())
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertIsNone(thumbnails.lookup(posts[0].image, 'card'))
+        self.assertIsNone(thumbnails.lookup(missing.image, 'card'))
+        for post in posts[1:]:
+            thumbnail = thumbnails.lookup(post.image, 'card')
+            self.assertEqual(list(thumbnail.size), [960, 339])
+            self.assertTrue(thumbnail.exists())
+
+        out = StringIO()
+        call_command('rebuild_thumbnails', workers=1, stdout=out)
+        self.assertIn('созданы для 1 картинок', out.getvalue())
+        self.assertIsNotNone(thumbnails.lookup(posts[0].image, 'card'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class HashMediaTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hash_media(self):
+        """hash_media переносит старые файлы под имена по хешу,
+        склеивает одинаковые и удаляет неиспользуемые"""
+
+        author = User.objects.create(username='author')
+        plain_storage = FileSystemStorage()
+        names = [plain_storage.save(f'posts/old{i}.gif',
+                                    SimpleUploadedFile('old.gif', b'same'))
+                 for i in range(2)]
+        posts = [Post.objects.create(text=name, author=author, image=name)
+                 for name in names]
+        Post.objects.create(text='Без файла', author=author,
+                            image='posts/missing.gif')
+        out = StringIO()
+        call_command('hash_media', batch_size=2, delete_old=True,
+                     stdout=out)
+        self.assertIn('перенесено 2, удалено старых файлов 2',
+                      out.getvalue())
+        new_names = {Post.objects.get(pk=post.pk).image.name
+                     for post in posts}
+        self.assertEqual(len(new_names), 1)
+        new_name = new_names.pop()
+        self.assertTrue(default_storage.is_hashed_name(new_name))
+        self.assertTrue(default_storage.exists(new_name))
+        for name in names:
+            self.assertFalse(plain_storage.exists(name))
+
+    def test_hash_media_queues_thumbnails(self):
+        """Перенесённая картинка получает миниатюры под новым именем,
+        и лента показывает её, а не заглушку"""
+
+        author = User.objects.create(username='author')
+        name = FileSystemStorage().save(
+            'posts/old.gif',
+            SimpleUploadedFile('old.gif', RebuildThumbnailsTest.small_gif)
+        )
+        post = Post.objects.create(text='Старая картинка', author=author,
+                                   image=name)
+        with mock.patch.object(tasks.transaction, 'on_commit',
+                               side_effect=lambda func: func()):
+            call_command('hash_media', delete_old=True, stdout=StringIO())
+        post.refresh_from_db()
+        thumbnail = thumbnails.lookup(post.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        content = self.client.get(reverse('posts:index')).content.decode()
+        self.assertIn(f'<img class="card-img my-2" src="{thumbnail.url}"',
+                      content)
+        self.assertNotIn('aspect-ratio', content)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class GcMediaTest(TestCase):
+    small_gif = RebuildThumbnailsTest.small_gif
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+
+    def make_old(self, storage, name):
+        os.utime(storage.path(name), (0, 0))
+
+    def test_gc_media(self):
+        """gc_media удаляет только старые файлы без постов,
+        их миниатюры и миниатюры без записи в kvstore"""
+
+        kept, deleted = [
+            Post.objects.create(
+                text=f'Пост {i}', author=self.author,
+                image=SimpleUploadedFile('gc.gif', self.small_gif + bytes([i]))
+            )
+            for i in range(2)
+        ]
+        for post in (kept, deleted):
+            thumbnails.generate(post.image)
+            self.make_old(default_storage, post.image.name)
+        deleted_name = deleted.image.name
+        deleted_thumbnail = thumbnails.lookup(deleted.image, 'card')
+        deleted.delete()
+        stray = default.storage.save('cache/00/00/stray.jpg',
+                                     ContentFile(b'stray'))
+        self.make_old(default.storage, stray)
+        fresh = default_storage.save('posts/fresh.gif',
+                                     ContentFile(self.small_gif))
+
+        out = StringIO()
+        call_command('gc_media', dry_run=True, stdout=out)
+        self.assertIn('картинок 1, записей kvstore 0, миниатюр 1',
+                      out.getvalue())
+        self.assertTrue(default_storage.exists(deleted_name))
+
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'gc_checkpoint')
+        call_command('gc_media', batch_size=1, checkpoint=checkpoint,
+                     stdout=StringIO())
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertFalse(default_storage.exists(deleted_name))
+        self.assertFalse(deleted_thumbnail.exists())
+        self.assertFalse(default.storage.exists(stray))
+        self.assertTrue(default_storage.exists(fresh))
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertTrue(thumbnails.lookup(kept.image, 'card').exists())
+
+    def test_gc_media_keeps_reuploaded_file(self):
+        """Повторная загрузка старого файла без постов освежает его,
+        и gc_media не удаляет его до записи нового поста"""
+
+        name = default_storage.save('posts/again.gif',
+                                    ContentFile(self.small_gif))
+        self.make_old(default_storage, name)
+        self.assertEqual(default_storage.save('posts/again.gif',
+                                              ContentFile(self.small_gif)),
+                         name)
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+class ImportContentTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def test_import_content(self):
+        """import_content загружает связанные записи порциями, пропускает
+        повторы и досчитывает счётчики, ленты и теги только своих
+        записей"""
+
+        User.objects.create(username='existing')
+        bystander = User.objects.create(username='bystander')
+        UserStats.objects.filter(user=bystander).update(posts_count=5)
+        users = self.write('users.csv', 'id,username,email\n'
+                                        'u1,reader,r@example.com\n'
+                                        'u2,writer,\n'
+                                        'u3,existing,\n')
+        records = [
+            {'type': 'group', 'id': 'g1', 'slug': 'imported',
+             'title': 'Импорт'},
+            *({'type': 'post', 'id': f'p{i}', 'author': 'u2', 'group': 'g1',
+               'text': f'Пост {i} #импорт',
+               'pub_date': f'2020-01-0{i}T10:00:00Z'}
+              for i in range(1, 4)),
+            {'type': 'post', 'id': 'p4', 'author': 'missing', 'text': '?'},
+            {'type': 'comment', 'id': 'c1', 'post': 'p1', 'author': 'u1',
+             'text': 'Комментарий', 'created': '2020-02-01T00:00:00'},
+            {'type': 'follow', 'user': 'u1', 'author': 'u2'},
+            {'type': 'follow', 'user': 'u1', 'author': 'u2'},
+            {'type': 'follow', 'user': 'u3', 'author': 'u2'},
+        ]
+        content = self.write('content.jsonl', '\n'.join(
+            json.dumps(record, ensure_ascii=False) for record in records
+        ))
+        id_map = os.path.join(self.directory.name, 'id_map.sqlite3')
+        out = StringIO()
+        call_command('import_content', users, type='user',
+                     id_map=id_map, stdout=out)
+        call_command('import_content', content, batch_size=2,
+                     id_map=id_map, stdout=out)
+        self.assertIn('post 3, comment 1, follow 3; пропущено 1',
+                      out.getvalue())
+
+        writer = User.objects.get(username='writer')
+        self.assertEqual(User.objects.filter(username='existing').count(), 1)
+        self.assertFalse(writer.has_usable_password())
+        posts = writer.posts.order_by('pub_date')
+        self.assertEqual(posts.count(), 3)
+        self.assertEqual(posts[0].pub_date.year, 2020)
+        self.assertEqual(posts[0].group, Group.objects.get(slug='imported'))
+        self.assertEqual(posts[0].comments_count, 1)
+        self.assertEqual(Comment.objects.get().created.month, 2)
+        self.assertEqual(Follow.objects.filter(author=writer).count(), 2)
+        self.assertEqual(writer.stats.followers_count, 2)
+        self.assertEqual(TimelineEntry.objects.filter(
+            user__username='reader'
+        ).count(), 3)
+        self.assertEqual(Tag.objects.get(name='импорт').posts_count, 3)
+        # Чужие расхождения импорт не трогает: это дело repair_counters.
+        self.assertEqual(
+            UserStats.objects.get(user=bystander).posts_count, 5
+        )
+
+        # Повторный запуск с той же картой id ничего не дублирует.
+        call_command('import_content', content, id_map=id_map,
+                     stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Comment.objects.count(), 1)
+        last_pk = posts.last().pk
+        new_post = Post.objects.create(author=writer, text='Новый')
+        self.assertGreater(new_post.pk, last_pk)
+
+
+class BenchSearchTest(TestCase):
+    def test_bench_search_rolls_back(self):
+        out = StringIO()
+        call_command('bench_search', posts=50, words=5, repeat=1,
+                     stdout=out)
+        self.assertIn('LIKE -> FTS5', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+
+
+class BackfillTagsTest(TestCase):
+    def test_backfill_tags(self):
+        """backfill_tags разбирает посты, созданные в обход сигналов,
+        и исправляет счётчики тегов"""
+        author = User.objects.create(username='writer')
+        Post.objects.bulk_create([
+            Post(author=author, text=f'#Кот и #пёс {i}, пишу @writer.')
+            for i in range(3)
+        ] + [Post(author=author, text='#кот @nobody и #1')])
+        Tag.objects.create(kind=Tag.HASHTAG, name='кот', posts_count=10)
+        Tag.objects.create(kind=Tag.HASHTAG, name='пусто')
+        out = StringIO()
+        call_command('backfill_tags', batch_size=2, stdout=out)
+        self.assertIn('Обработано постов: 4', out.getvalue())
+        counts = dict(Tag.objects.values_list('name', 'posts_count'))
+        self.assertEqual(counts, {'кот': 4, 'пёс': 3, 'writer': 3})
+        links = PostTag.objects.count()
+        call_command('backfill_tags', stdout=StringIO())
+        self.assertEqual(PostTag.objects.count(), links)
+
+
+@override_settings(RELATED_POSTS_COUNT=2, RELATED_MIN_SCORE=0.1,
+                   RELATED_MAX_DF=1.0)
+class BuildRelatedPostsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='writer')
+
+    def create(self, text):
+        return Post.objects.create(author=self.author, text=text)
+
+    def related(self, post):
+        return list(related.related_posts(post))
+
+    def test_build_related_posts(self):
+        """build_related_posts находит соседей блоками, а потом
+        пересчитывает только новые и изменённые посты"""
+        cats = [self.create('Кошки любят рыбу и молоко'),
+                self.create('Кошки спят на солнце, рыбу едят вечером'),
+                self.create('Кошки и собаки')]
+        trains = [self.create('Поезд опоздал на вокзал'),
+                  self.create('Вокзал, поезд и расписание')]
+        out = StringIO()
+        call_command('build_related_posts', block_size=2, stdout=out)
+        self.assertIn('Пересчитано постов: 5', out.getvalue())
+        self.assertEqual(self.related(cats[0]), [cats[1], cats[2]])
+        self.assertEqual(self.related(trains[0]), [trains[1]])
+        self.assertFalse(Post.objects.filter(related_at=None).exists())
+        self.assertEqual(RelatedPost.objects.count(), 8)
+
+        # Новый пост попадает и в списки старых постов.
+        fresh = self.create('Поезд до вокзала: расписание поменяли')
+        trains[1].text = 'Кошки на вокзале едят рыбу'
+        trains[1].save()
+        out = StringIO()
+        call_command('build_related_posts', stdout=out)
+        self.assertIn('Пересчитано постов: 2', out.getvalue())
+        self.assertEqual(self.related(fresh)[0], trains[0])
+        self.assertEqual(self.related(trains[0])[0], fresh)
+        self.assertIn(cats[0], self.related(trains[1]))
+
+        call_command('build_related_posts', full=True, stdout=StringIO())
+        self.assertNotIn(trains[1], self.related(trains[0]))
+        self.assertEqual(self.related(trains[0]), [fresh])
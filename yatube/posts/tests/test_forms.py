@@ -1,12 +1,15 @@
 import http
 import tempfile
+from io import BytesIO
 
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db.models.fields.files import ImageFieldFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from ..management.commands.bench_images import make_photo
 from ..models import Comment, Group, Post
 
 User = get_user_model()
@@ -184,3 +187,45 @@ class CreateFormTests(TestCase):
                 text=form_data['text'],
             ).exists()
         )
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir(), POST_IMAGE_MAX_SIDE=200)
+class ImageNormalizeTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='photographer')
+        self.client.force_login(self.author)
+
+    def create_post(self, name, content):
+        self.client.post(reverse('posts:post_create'), data={
+            'text': name,
+            'image': SimpleUploadedFile(name, content),
+        })
+        return Post.objects.get(text=name)
+
+    def test_photo_downscaled_rotated_and_stripped(self):
+        """Фото уменьшается, поворачивается по EXIF и теряет метаданные"""
+
+        post = self.create_post('photo.jpg', make_photo((400, 300)))
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        self.assertEqual((post.image_width, post.image_height), (150, 200))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.size, (150, 200))
+            self.assertEqual(len(image.getexif()), 0)
+
+    @override_settings(POST_IMAGE_FORMAT='WEBP')
+    def test_webp_keeps_transparency(self):
+        content = BytesIO()
+        Image.new('RGBA', (50, 50), (0, 0, 255, 128)).save(content, 'PNG')
+        post = self.create_post('alpha.png', content.getvalue())
+        self.assertTrue(post.image.name.endswith('.webp'))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.mode, 'RGBA')
+
+    def test_small_clean_image_kept(self):
+        """Картинку, которую нечего улучшать, форма не пересохраняет"""
+
+        content = BytesIO()
+        Image.new('RGB', (50, 50)).save(content, 'JPEG')
+        post = self.create_post('clean.jpg', content.getvalue())
+        self.assertEqual(post.image.read(), content.getvalue())
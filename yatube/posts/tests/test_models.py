@@ -1,9 +1,24 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
 
-from ..models import Group, Post
+from .. import counters
+from ..models import Comment, Follow, Group, Post, UserStats
 
 User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostModelTest(TestCase):
@@ -84,3 +99,138 @@ class PostModelTest(TestCase):
             with self.subTest(label=label):
                 verbose = help_text[0]._meta.get_field(help_text[1]).help_text
                 self.assertEqual(verbose, help_text[2])
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+
+    def test_counters_follow_changes(self):
+        """Счётчики меняются вместе с постами, комментариями и подписками"""
+
+        post = Post.objects.create(author=self.author, text='Текст')
+        Post.objects.create(author=self.author, text='Текст 2')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).posts_count,
+                         2)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 1
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 1
+        )
+        comment.delete()
+        follow.delete()
+        post.delete()
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 0)
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 0
+        )
+
+    def test_repair_counters(self):
+        """repair_counters чинит разошедшиеся и пропавшие счётчики"""
+
+        post = Post.objects.create(author=self.author, text='Текст')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        UserStats.objects.filter(user=self.reader).delete()
+        Post.objects.update(comments_count=0)
+        call_command('repair_counters', batch_size=1, stdout=StringIO())
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 1
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_comment_rolls_back_with_counter(self):
+        """Комментарий не сохраняется, если не удалось сдвинуть счётчик"""
+
+        post = Post.objects.create(author=self.author, text='Текст')
+        client = Client()
+        client.force_login(self.reader)
+        with mock.patch.object(counters, 'bump_post_comments',
+                               side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                client.post(
+                    reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+                    {'text': 'Комментарий'}
+                )
+        self.assertFalse(Comment.objects.exists())
+
+    def test_deleting_user_does_not_break_counters(self):
+        Post.objects.create(author=self.author, text='Текст')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.author.delete()
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 0
+        )
+        self.assertFalse(UserStats.objects.filter(user_id=self.author.pk)
+                         .exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageInfoTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+
+    @staticmethod
+    def make_png(size=(30, 20), color=(255, 0, 0)):
+        content = BytesIO()
+        Image.new('RGB', size, color).save(content, 'PNG')
+        return content.getvalue()
+
+    def test_image_info_on_upload(self):
+        """Размеры, вес и цвет картинки сохраняются при загрузке"""
+
+        content = self.make_png()
+        post = Post.objects.create(
+            author=self.author, text='Текст',
+            image=SimpleUploadedFile('red.png', content, 'image/png'),
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (30, 20))
+        self.assertEqual(post.image_size, len(content))
+        self.assertEqual(post.image_color, '#ff0000')
+        self.assertEqual(post.image.read(), content)
+
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_color, '')
+
+    def test_fill_image_info(self):
+        """fill_image_info заполняет поля у ранее загруженных картинок"""
+
+        name = default_storage.save(
+            'posts/blue.png', ContentFile(self.make_png(color=(0, 0, 255)))
+        )
+        post = Post.objects.create(author=self.author, text='Текст',
+                                   image=name)
+        missing = Post.objects.create(author=self.author, text='Текст',
+                                      image='posts/missing.png')
+        self.assertIsNone(Post.objects.get(pk=post.pk).image_width)
+        out = StringIO()
+        call_command('fill_image_info', stdout=out)
+        self.assertIn('ошибок: 1', out.getvalue())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (30, 20))
+        self.assertEqual(post.image_color, '#0000ff')
+        self.assertIsNone(Post.objects.get(pk=missing.pk).image_width)
@@ -1,20 +1,47 @@
+import http
+import json
+import math
 import shutil
 import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 
-from ..models import Comment, Follow, Group, Post
+from core import tasks
+from core.models import Task
+
+from .. import cache_versions, signals, thumbnails, trending
+from ..autocomplete import PrefixIndex, autocomplete, publish, user_entry
+from ..models import (Comment, Follow, Group, Post, RelatedPost, Tag,
+                      TimelineEntry, UserStats)
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
+def bump_without_commit(test):
+    """TestCase не коммитит транзакцию: версии кэша сдвигаются сразу,
+    как после коммита."""
+    patcher = mock.patch.object(
+        cache_versions, 'transaction',
+        **{'on_commit.side_effect': lambda func: func()}
+    )
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class TestPages(TestCase):
     @classmethod
@@ -260,6 +287,10 @@ class TestCash(TestCase):
         )
         cls.reverse_index = reverse('posts:index')
 
+    def setUp(self):
+        bump_without_commit(self)
+        cache.clear()
+
     def test_cash_index_page(self):
         """Тестирует работу кэширования на
         главной странице"""
@@ -269,14 +300,202 @@ class TestCash(TestCase):
         client.force_login(author)
         response = client.get(self.reverse_index)
         content = response.content
-        Post.objects.create(
-            text='test',
-            author=author
-        )
+        Post.objects.filter(pk=self.post.pk).update(text='Тайком')
         self.assertEqual(content, client.get(self.reverse_index).content)
         cache.clear()
         self.assertNotEqual(content, client.get(self.reverse_index).content)
 
+    def test_cash_invalidated_by_changes(self):
+        """Фрагменты лент сбрасываются при изменении данных"""
+
+        group = Group.objects.create(
+            title='Группа',
+            slug='cache_group',
+            description='Описание'
+        )
+        urls = (
+            self.reverse_index,
+            reverse('posts:group_list', kwargs={'slug': group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.user_auth.username}),
+        )
+        client = Client()
+        for url in urls:
+            client.get(url)
+        self.post.text = 'Отредактированный текст'
+        self.post.group = group
+        self.post.save()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertIn(self.post.text,
+                              client.get(url).content.decode())
+
+    def test_post_card_shared_between_feeds(self):
+        """Карточка поста кэшируется одна на все ленты,
+        а ссылка на редактирование остаётся своей у каждого"""
+
+        group = Group.objects.create(
+            title='Группа',
+            slug='card_group',
+            description='Описание'
+        )
+        post = Post.objects.get(pk=self.post.pk)
+        post.group = group
+        post.save()
+        edit_url = reverse('posts:post_edit', kwargs={'post_id': self.post.pk})
+        guest = Client()
+        author = Client()
+        author.force_login(self.user_auth)
+        self.assertNotIn(edit_url, guest.get(self.reverse_index)
+                         .content.decode())
+        self.assertIn(edit_url, author.get(self.reverse_index)
+                      .content.decode())
+        Post.objects.filter(pk=self.post.pk).update(text='Тайком')
+        response = guest.get(
+            reverse('posts:group_list', kwargs={'slug': group.slug})
+        )
+        self.assertIn(post.text, response.content.decode())
+        post.refresh_from_db()
+        post.save()
+        response = guest.get(
+            reverse('posts:group_list', kwargs={'slug': group.slug})
+        )
+        self.assertIn('Тайком', response.content.decode())
+
+    def test_cash_follow_page(self):
+        reader = User.objects.create(username='reader')
+        client = Client()
+        client.force_login(reader)
+        reverse_follow = reverse('posts:follow_index')
+        self.assertNotIn(self.post.text,
+                         client.get(reverse_follow).content.decode())
+        Follow.objects.create(user=reader, author=self.user_auth)
+        self.assertIn(self.post.text,
+                      client.get(reverse_follow).content.decode())
+
+    def test_cash_author_renamed(self):
+        guest = Client()
+        guest.get(self.reverse_index)
+        updated = Post.objects.get(pk=self.post.pk).updated
+        author = User.objects.get(pk=self.user_auth.pk)
+        author.set_password('новый пароль')
+        author.save()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).updated, updated)
+        self.assertIsNone(UserStats.objects.get(user=author).profile_changed)
+        author.first_name = 'Переименованный'
+        author.save()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).updated, updated)
+        self.assertIn('Переименованный',
+                      guest.get(self.reverse_index).content.decode())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASK_WORKERS=0)
+class ThumbnailTest(TestCase):
+    small_gif = (
+        b'\x47\x49\x46\x38\x39\x61\x02\x00'
+        b'\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+        b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+        b'\x0A\x00\x3B'
+    )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        bump_without_commit(self)
+        cache.clear()
+        self.author = User.objects.create(username='photographer')
+
+    def create_post(self):
+        return Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            ),
+        )
+
+    def test_placeholder_until_thumbnail_ready(self):
+        """Пока миниатюры нет, страница показывает заглушку
+        и не создаёт миниатюру сама"""
+
+        post = self.create_post()
+        queued = Task.objects.count()
+        content = self.client.get(reverse('posts:index')).content.decode()
+        self.assertIn('aspect-ratio', content)
+        self.assertIsNone(thumbnails.lookup(post.image, 'card'))
+        self.assertEqual(Task.objects.count(), queued)
+        updated = post.updated
+
+        self.assertTrue(thumbnails.generate(post.image))
+        post.refresh_from_db()
+        self.assertGreater(post.updated, updated)
+        thumbnail = thumbnails.lookup(post.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        for url in (reverse('posts:index'),
+                    reverse('posts:post_detail', args=(post.pk,))):
+            with self.subTest(url=url):
+                content = self.client.get(url).content.decode()
+                self.assertIn(thumbnail.url, content)
+                self.assertNotIn('aspect-ratio', content)
+
+    def test_upload_queues_thumbnails(self):
+        """Сохранение поста с новой картинкой создаёт миниатюры
+        после коммита"""
+
+        with mock.patch.object(tasks.transaction, 'on_commit',
+                               side_effect=lambda func: func()) as on_commit:
+            post = self.create_post()
+            on_commit.reset_mock()
+            post.text = 'Картинка та же'
+            post.save()
+        self.assertIsNotNone(thumbnails.lookup(post.image, 'card'))
+        on_commit.assert_not_called()
+
+    @override_settings(POST_IMAGE_WIDTHS=(480, 1440))
+    def test_srcset_lists_ready_variants(self):
+        """srcset содержит варианты не шире исходной картинки"""
+
+        content = BytesIO()
+        Image.new('RGB', (1000, 400)).save(content, 'PNG')
+        post = Post.objects.create(
+            text='Широкая картинка',
+            author=self.author,
+            image=SimpleUploadedFile('wide.png', content.getvalue()),
+        )
+        self.assertTrue(thumbnails.generate(post.image))
+        small = thumbnails.lookup(post.image, 'card', 480)
+        self.assertEqual(list(small.size), [480, 170])
+        self.assertIsNone(thumbnails.lookup(post.image, 'card', 1440))
+        content = self.client.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        ).content.decode()
+        self.assertIn(f'srcset="{small.url} 480w, ', content)
+        self.assertIn(' 960w"', content)
+        self.assertNotIn('1440w', content)
+
+    def test_missing_image_keeps_placeholder(self):
+        """Ошибка остаётся в упавшей задаче, и страница не ставит
+        картинку в очередь снова"""
+
+        with override_settings(TASK_RUN_LOCALLY=False, TASK_MAX_ATTEMPTS=1):
+            post = Post.objects.create(text='Без файла', author=self.author,
+                                       image='posts/missing.jpg')
+            task = Task.objects.get(key=post.image.name)
+            self.assertFalse(tasks.run(task.pk))
+        task.refresh_from_db()
+        self.assertTrue(task.failed)
+        self.assertIn('ThumbnailError', task.last_error)
+        self.assertIsNone(thumbnails.lookup(post.image, 'card'))
+        self.client.get(reverse('posts:post_detail', args=(post.pk,)))
+        self.assertEqual(Task.objects.count(), 1)
+
 
 class TestFollow(TestCase):
     """Тестирует систему подписок"""
@@ -347,3 +566,582 @@ class TestFollow(TestCase):
         follow = Follow.objects.filter(user=user, author=author).exists()
         self.assertTrue(follow)
         self.assertEqual(Follow.objects.count(), follow_count + 1)
+
+    def test_unfollow_removes_posts_from_feed(self):
+        self.client_user.get(reverse(
+            'posts:profile_unfollow',
+            args={self.authorized_user_author.username}
+        ))
+        response = self.client_user.get(reverse('posts:follow_index'))
+        self.assertNotIn(self.post, response.context['page_obj'])
+
+    def test_new_post_appears_in_feed(self):
+        post = Post.objects.create(
+            text='Новый пост',
+            author=self.authorized_user_author
+        )
+        response = self.client_user.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], post)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_in_feed(self):
+        """Посты авторов-знаменитостей подмешиваются живым запросом"""
+
+        post = Post.objects.create(
+            text='Пост знаменитости',
+            author=self.authorized_user_author
+        )
+        self.assertFalse(post.timeline_entries.exists())
+        response = self.client_user.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page_obj'])
+        self.assertIn(self.post, response.context['page_obj'])
+        # Подписчиков снова меньше порога, а пост, который не попал
+        # в ленты, всё равно в ленте.
+        with override_settings(TIMELINE_FANOUT_LIMIT=1000):
+            response = self.client_user.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page_obj'])
+
+    def test_backfill_timeline(self):
+        TimelineEntry.objects.all().delete()
+        call_command('backfill_timeline', stdout=StringIO())
+        response = self.client_user.get(reverse('posts:follow_index'))
+        self.assertIn(self.post, response.context['page_obj'])
+
+
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user_auth = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='Заголовок',
+            slug='test_slug',
+            description='Описание'
+        )
+        cls.count_post_obj = 13
+        object_post = [
+            Post(
+                text=f'Текст {i}',
+                author=cls.user_auth,
+                group=cls.group
+            )
+            for i in range(0, cls.count_post_obj)
+        ]
+        Post.objects.bulk_create(object_post)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_cursor_pages_cover_all_posts(self):
+        """Курсорный паджинатор проходит все посты без повторов"""
+
+        reverse_list = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.user_auth.username}),
+        )
+        for url in reverse_list:
+            with self.subTest(url=url):
+                first_page = self.guest_client.get(
+                    url + '?cursor=').context['page_obj']
+                self.assertEqual(len(first_page), settings.COUNT_PAGE)
+                self.assertFalse(first_page.has_previous())
+                second_page = self.guest_client.get(
+                    url + '?cursor=' + first_page.next_cursor
+                ).context['page_obj']
+                self.assertEqual(
+                    len(second_page),
+                    self.count_post_obj - settings.COUNT_PAGE
+                )
+                self.assertFalse(second_page.has_next())
+                seen = [post.pk for post in first_page]
+                seen += [post.pk for post in second_page]
+                self.assertEqual(
+                    seen,
+                    list(Post.objects.order_by('-pub_date', '-pk')
+                         .values_list('pk', flat=True))
+                )
+                back_page = self.guest_client.get(
+                    url + '?cursor=' + second_page.previous_cursor
+                ).context['page_obj']
+                self.assertEqual(list(back_page), list(first_page))
+
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_cursor_mode_setting(self):
+        """В режиме cursor страница без параметров отдаётся по курсору,
+        а старые ссылки ?page=N продолжают работать"""
+
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertTrue(response.context['page_obj'].is_cursor)
+        response = self.guest_client.get(reverse('posts:index') + '?page=2')
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_broken_cursor_returns_first_page(self):
+        """Битый курсор не ломает страницу"""
+
+        response = self.guest_client.get(
+            reverse('posts:index') + '?cursor=broken')
+        self.assertEqual(len(response.context['page_obj']),
+                         settings.COUNT_PAGE)
+
+
+class CacheVersionsTest(TestCase):
+    def test_bump_waits_for_commit(self):
+        """Версия не сдвигается, пока транзакция не закоммичена"""
+
+        cache.clear()
+        version, = cache_versions.get_versions('posts')
+        cache_versions.bump('posts')
+        self.assertEqual(cache_versions.get_versions('posts'), [version])
+        with mock.patch.object(cache_versions.transaction, 'on_commit',
+                               side_effect=lambda func: func()):
+            cache_versions.bump('posts')
+        self.assertGreater(cache_versions.get_versions('posts')[0], version)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='Заголовок',
+            slug='test_slug',
+            description='Описание'
+        )
+        cls.post = Post.objects.create(
+            text='Текст',
+            author=cls.author,
+            group=cls.group
+        )
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': cls.group.slug}),
+            reverse('posts:profile', kwargs={'username': cls.author.username}),
+            reverse('posts:post_detail', kwargs={'post_id': cls.post.pk}),
+        )
+
+    def setUp(self):
+        bump_without_commit(self)
+        cache.clear()
+        self.client = Client()
+
+    def test_not_modified(self):
+        """Неизменившиеся страницы отдаются ответом 304"""
+
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(response.has_header('ETag'))
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+                self.assertEqual(response.status_code,
+                                 http.HTTPStatus.NOT_MODIFIED)
+
+    def test_modified_after_comment(self):
+        """Новый комментарий меняет ETag страниц с этим постом"""
+
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.author,
+                               text='Комментарий')
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, http.HTTPStatus.OK)
+
+    def test_last_modified_after_its_second(self):
+        """Last-Modified отдаётся, только когда его секунда прошла:
+        изменение в ту же секунду не спрячется за 304"""
+
+        url = self.urls[0]
+        self.assertFalse(self.client.get(url).has_header('Last-Modified'))
+        later = time.time() + 2
+        with mock.patch.object(cache_versions.time, 'time',
+                               return_value=later):
+            last_modified = self.client.get(url)['Last-Modified']
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+        self.assertEqual(response.status_code,
+                         http.HTTPStatus.NOT_MODIFIED)
+
+    def test_etag_changes_with_csrf_token(self):
+        """После повторного входа токен в форме новый, и старая
+        страница из кэша браузера не подходит"""
+
+        url = self.urls[3]
+        self.client.force_login(self.author)
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,
+                         http.HTTPStatus.NOT_MODIFIED)
+        del self.client.cookies[settings.CSRF_COOKIE_NAME]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, http.HTTPStatus.OK)
+
+    def test_etag_depends_on_viewer(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, http.HTTPStatus.OK)
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='')
+        cls.posts = [
+            Post.objects.create(text=f'Пост, "{i}"', author=cls.author,
+                                group=cls.group if i % 2 else None)
+            for i in range(3)
+        ]
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_profile_and_group_exports(self):
+        response = self.client.get(reverse(
+            'posts:profile_export', args=['author', 'csv']
+        ))
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="posts-author.csv"')
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0], 'id,author,group,text,pub_date,image,'
+                                   'comments_count')
+        self.assertEqual(len(lines), 4)
+        self.assertIn('"Пост, ""0"""', lines[1])
+
+        response = self.client.get(reverse(
+            'posts:group_export', args=['group', 'json']
+        ))
+        exported = json.loads(self.content(response))
+        self.assertEqual([post['id'] for post in exported],
+                         [self.posts[1].pk])
+        self.assertEqual(exported[0]['group'], 'group')
+
+        missing = self.client.get(reverse(
+            'posts:profile_export', args=['author', 'xml']
+        ))
+        self.assertEqual(missing.status_code, http.HTTPStatus.NOT_FOUND)
+
+    def test_site_export_is_for_staff(self):
+        url = reverse('posts:site_export', args=['json'])
+        self.assertEqual(self.client.get(url).status_code,
+                         http.HTTPStatus.FOUND)
+        self.client.force_login(self.staff)
+        self.assertEqual(len(json.loads(self.content(self.client.get(url)))),
+                         3)
+
+    def test_export_posts_command(self):
+        out = StringIO()
+        call_command('export_posts', author='author', export_format='json',
+                     stdout=out)
+        self.assertEqual(len(json.loads(out.getvalue())), 3)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='writer')
+        cls.cats = Post.objects.create(
+            text='Кот и коты: <b>кот</b> спит', author=cls.author
+        )
+        cls.dog = Post.objects.create(text='Собака и кот', author=cls.author)
+        cls.other = Post.objects.create(text='Про погоду', author=cls.author)
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': query, **params})
+        return response.context['page_obj']
+
+    def test_ranked_results_with_snippets(self):
+        page = self.search('кот')
+        self.assertEqual(list(page), [self.cats, self.dog])
+        self.assertIn('<mark>Кот</mark>', page[0].snippet_html)
+        self.assertIn('&lt;b&gt;<mark>кот</mark>&lt;/b&gt;',
+                      page[0].snippet_html)
+        self.assertEqual(list(self.search('кот собака')), [self.dog])
+        self.assertEqual(list(self.search('"OR* (')), [])
+        self.assertIsNone(self.search(''))
+        for query in ('!!!', '"'):
+            with self.subTest(query=query):
+                self.assertIsNone(self.search(query))
+
+    def test_index_follows_changes(self):
+        self.other.text = 'Кот под дождём'
+        self.other.save()
+        Post.objects.filter(pk=self.dog.pk).delete()
+        Post.objects.bulk_create([Post(text='Ещё кот', author=self.author)])
+        texts = {post.text for post in self.search('кот')}
+        self.assertEqual(texts, {self.cats.text, 'Кот под дождём',
+                                 'Ещё кот'})
+        self.assertEqual(list(self.search('собака')), [])
+
+    @override_settings(COUNT_PAGE=2)
+    def test_cursor_pagination(self):
+        extra = [Post.objects.create(text=f'кот {i}', author=self.author)
+                 for i in range(3)]
+        first = self.search('кот')
+        second = self.search('кот', cursor=first.next_cursor)
+        third = self.search('кот', cursor=second.next_cursor)
+        seen = list(first) + list(second) + list(third)
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), {self.cats, self.dog, *extra})
+        self.assertFalse(third.has_next())
+        back = self.search('кот', cursor=second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create(username='admin', is_staff=True,
+                                    is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'q': 'собака'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.dog])
+
+
+class AutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fedor = User.objects.create(username='fedor', first_name='Фёдор',
+                                        last_name='Достоевский')
+        cls.fedya = User.objects.create(username='fedya')
+        cls.group = Group.objects.create(title='Федеральные новости',
+                                         slug='fed', description='')
+        Follow.objects.create(user=cls.fedya, author=cls.fedor)
+
+    def setUp(self):
+        cache.clear()
+        autocomplete.index = None
+
+    def lookup(self, query, **params):
+        response = self.client.get(reverse('posts:autocomplete'),
+                                   {'q': query, **params})
+        return [item['label'] for item in response.json()['results']]
+
+    def test_prefix_lookup_by_popularity(self):
+        self.assertEqual(self.lookup('фе'), [
+            'Фёдор Достоевский (fedor)', 'Федеральные новости',
+        ])
+        self.assertEqual(self.lookup('FED'), [
+            'Фёдор Достоевский (fedor)', 'fedya', 'Федеральные новости',
+        ])
+        self.assertEqual(self.lookup('дост'), ['Фёдор Достоевский (fedor)'])
+        self.assertEqual(self.lookup('fed', limit=1),
+                         ['Фёдор Достоевский (fedor)'])
+        self.assertEqual(self.lookup(''), [])
+        self.assertEqual(self.lookup('нет'), [])
+        response = self.client.get(reverse('posts:autocomplete'), {'q': 'но'})
+        self.assertEqual(response.json()['results'], [{
+            'type': 'group',
+            'label': 'Федеральные новости',
+            'url': reverse('posts:group_list', args=['fed']),
+        }])
+
+    def test_index_follows_changes(self):
+        self.lookup('fed')
+        with mock.patch.object(signals.transaction, 'on_commit',
+                               side_effect=lambda func: func()):
+            User.objects.create(username='fedot')
+            self.fedya.is_active = False
+            self.fedya.save()
+            self.group.delete()
+        index = autocomplete.index
+        self.assertEqual(self.lookup('fed'),
+                         ['Фёдор Достоевский (fedor)', 'fedot'])
+        self.assertIs(autocomplete.index, index)
+
+    def test_index_applies_log_of_other_processes(self):
+        self.lookup('fed')
+        index = autocomplete.index
+        publish(('user', self.fedya.pk), None)
+        self.assertEqual(self.lookup('fed'), [
+            'Фёдор Достоевский (fedor)', 'Федеральные новости',
+        ])
+        self.assertIs(autocomplete.index, index)
+        # Журнал потерян: индекс перестраивается в фоне, а запрос
+        # отвечает по старому.
+        cache.clear()
+        with mock.patch.object(autocomplete,
+                               'rebuild_in_background') as rebuild:
+            self.lookup('fed')
+        rebuild.assert_called_once_with()
+        autocomplete.rebuilding = False
+        self.lookup('fed')
+        self.assertIsNot(autocomplete.index, index)
+        self.assertEqual(self.lookup('fed'), [
+            'Фёдор Достоевский (fedor)', 'fedya', 'Федеральные новости',
+        ])
+
+    def test_add_and_remove(self):
+        index = PrefixIndex([user_entry(self.fedor, 5)])
+        index.add(*user_entry(self.fedya, 1))
+        index.add(*user_entry(self.fedor, 0))
+        self.assertEqual([item['label'] for item in index.lookup('fe', 10)],
+                         ['fedya', 'Фёдор Достоевский (fedor)'])
+        index.remove(('user', self.fedya.pk))
+        index.remove(('user', self.fedya.pk))
+        self.assertEqual(len(index.keys), len(index.refs))
+        self.assertEqual([item['label'] for item in index.lookup('fe', 10)],
+                         ['Фёдор Достоевский (fedor)'])
+
+
+class TagTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='writer')
+        cls.reader = User.objects.create(username='reader.one')
+
+    def setUp(self):
+        cache.clear()
+
+    def count(self, kind, name):
+        tag = Tag.objects.filter(kind=kind, name=name).first()
+        return None if tag is None else tag.posts_count
+
+    def test_tags_follow_post_text(self):
+        post = Post.objects.create(
+            author=self.author,
+            text='#Кот и #кот, спасибо @reader.one. Пишите на a@b.c #2',
+        )
+        self.assertEqual(
+            set(post.tags.values_list('kind', 'name')),
+            {(Tag.HASHTAG, 'кот'), (Tag.MENTION, 'reader.one')},
+        )
+        self.assertEqual(self.count(Tag.HASHTAG, 'кот'), 1)
+        post.text = '#пёс @ghost'
+        post.save()
+        self.assertEqual(self.count(Tag.HASHTAG, 'кот'), 0)
+        self.assertEqual(self.count(Tag.MENTION, 'reader.one'), 0)
+        self.assertEqual(self.count(Tag.HASHTAG, 'пёс'), 1)
+        self.assertIsNone(self.count(Tag.MENTION, 'ghost'))
+        post.delete()
+        self.assertEqual(self.count(Tag.HASHTAG, 'пёс'), 0)
+
+    @override_settings(COUNT_PAGE=2)
+    def test_tag_feed(self):
+        posts = [Post.objects.create(author=self.author, text=f'#Кот {i}')
+                 for i in range(3)]
+        Post.objects.create(author=self.author, text='без тегов')
+        url = reverse('posts:tag_posts', args=['КОТ'])
+        first = self.client.get(url, {'cursor': ''}).context['page_obj']
+        self.assertEqual(list(first), posts[:0:-1])
+        second = self.client.get(url, {'cursor': first.next_cursor})
+        self.assertEqual(list(second.context['page_obj']), posts[:1])
+        self.assertEqual(
+            self.client.get(url, {'page': 2}).context['page_obj'][0],
+            posts[0],
+        )
+        response = self.client.get(reverse('posts:tag_posts', args=['пёс']))
+        self.assertEqual(response.status_code, http.HTTPStatus.NOT_FOUND)
+
+    def test_mention_feed_and_links(self):
+        post = Post.objects.create(author=self.author,
+                                   text='<b>#Кот</b> для @reader.one!')
+        Post.objects.create(author=self.author, text='Привет, @ghost')
+        url = reverse('posts:mention_posts', args=['reader.one'])
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['page_obj']), [post])
+        response = self.client.get(
+            reverse('posts:mention_posts', args=['writer'])
+        )
+        self.assertEqual(list(response.context['page_obj']), [])
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(
+            response,
+            '&lt;b&gt;<a href="/tag/%D0%BA%D0%BE%D1%82/">#Кот</a>&lt;/b&gt; '
+            f'для <a href="{url}">@reader.one</a>!',
+            html=False,
+        )
+        self.assertContains(response, 'Привет, @ghost')
+
+
+@override_settings(TRENDING_HALF_LIFE=3600, TRENDING_MIN_SCORE=0.1,
+                   TRENDING_COMMENT_WEIGHT=1.0, TRENDING_REACH_WEIGHT=1.0)
+class TrendingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='writer')
+        cls.reader = User.objects.create(username='reader')
+
+    def setUp(self):
+        cache.clear()
+
+    def score(self, post):
+        return Post.objects.get(pk=post.pk).trending_score
+
+    def test_scores_follow_comments_reach_and_decay(self):
+        quiet = Post.objects.create(author=self.author, text='Тихий')
+        self.assertEqual(self.score(quiet), 0)
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Обсуждаемый')
+        self.assertAlmostEqual(self.score(post), math.log(2), places=3)
+        comments = [Comment.objects.create(post=post, author=self.reader,
+                                           text=str(i)) for i in range(2)]
+        self.assertAlmostEqual(self.score(post), math.log(2) + 2, places=3)
+        comments[0].delete()
+        self.assertAlmostEqual(self.score(post), math.log(2) + 1, places=3)
+        self.assertTrue(Task.objects.filter(key='trending').exists())
+
+        hour_later = timezone.now() + timedelta(hours=1)
+        Task.objects.filter(key='trending').delete()
+        with mock.patch.object(trending.timezone, 'now',
+                               return_value=hour_later):
+            self.assertEqual(trending.decay(batch_size=1), (1, 0))
+        self.assertAlmostEqual(self.score(post), (math.log(2) + 1) / 2,
+                               places=3)
+        # Пост ещё в ленте: остывание поставило следующее.
+        self.assertTrue(Task.objects.filter(key='trending').exists())
+        Task.objects.filter(key='trending').delete()
+        with mock.patch.object(trending.timezone, 'now',
+                               return_value=hour_later
+                               + timedelta(hours=10)):
+            self.assertEqual(trending.decay(), (1, 1))
+        self.assertEqual(self.score(post), 0)
+        self.assertFalse(Task.objects.filter(key='trending').exists())
+
+    def test_trending_page(self):
+        posts = [Post.objects.create(author=self.author, text=f'Пост {i}')
+                 for i in range(3)]
+        for count, post in zip((1, 3), posts):
+            for i in range(count):
+                Comment.objects.create(post=post, author=self.reader,
+                                       text=str(i))
+        with self.assertNumQueries(1):
+            self.assertEqual(list(trending.top()), [posts[1], posts[0]])
+        response = self.client.get(reverse('posts:trending'))
+        self.assertEqual(list(response.context['page_obj']),
+                         [posts[1], posts[0]])
+
+
+class RelatedPostsViewTest(TestCase):
+    def test_post_detail_shows_related_posts(self):
+        author = User.objects.create(username='writer')
+        post, near, far = (
+            Post.objects.create(author=author, text=text)
+            for text in ('Про кошек', 'Ещё про кошек', 'Тоже про кошек')
+        )
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post=post, related=far, score=0.2),
+            RelatedPost(post=post, related=near, score=0.9),
+            RelatedPost(post=near, related=post, score=0.9),
+        ])
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertEqual(list(response.context['related_posts']),
+                         [near, far])
+        self.assertContains(response, 'Похожие посты')
+        response = self.client.get(
+            reverse('posts:post_detail', args=[far.pk])
+        )
+        self.assertNotContains(response, 'Похожие посты')
@@ -0,0 +1,230 @@
+import logging
+
+from django.conf import settings
+from django.dispatch import Signal
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import tasks
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Размеры, в которых шаблоны показывают картинки постов: базовый
+# размер, опции sorl и атрибут sizes для srcset. Кроме базового размера
+# создаются варианты той же пропорции шириной из POST_IMAGE_WIDTHS.
+PRESETS = {
+    'card': {
+        'size': (960, 339),
+        'options': {'crop': 'center', 'upscale': True},
+        'sizes': '(max-width: 992px) 100vw, 960px',
+    },
+}
+
+# Отправляется с именем картинки, когда для неё готовы новые миниатюры.
+thumbnails_ready = Signal()
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+class PostThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет искать готовую миниатюру в kvstore
+    и создавать файл миниатюры, не трогая kvstore.
+
+    Имя миниатюры строится так же, как в ThumbnailBackend.get_thumbnail.
+    """
+
+    def get_options(self, source, options):
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def get_thumbnail_file(self, source, geometry_string, options):
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def lookup(self, source, geometry_string, **options):
+        options = self.get_options(source, options)
+        return default.kvstore.get(
+            self.get_thumbnail_file(source, geometry_string, options)
+        )
+
+    def render(self, source, geometry_string, force=False, **options):
+        """Создаёт файл миниатюры и возвращает его с известным размером.
+
+        Размер исходника тоже запоминается в source, чтобы его можно
+        было записать в kvstore без повторного открытия картинки.
+        """
+        options = self.get_options(source, options)
+        thumbnail = self.get_thumbnail_file(source, geometry_string, options)
+        if not force and thumbnail.exists():
+            if source.size is None:
+                source.set_size()
+            thumbnail.set_size()
+            return thumbnail
+        source_image = default.engine.get_image(source)
+        try:
+            options['image_info'] = default.engine.get_image_info(
+                source_image
+            )
+            source.set_size(default.engine.get_image_size(source_image))
+            self._create_thumbnail(source_image, geometry_string, options,
+                                   thumbnail)
+            self._create_alternative_resolutions(
+                source_image, geometry_string, options, thumbnail.name
+            )
+        finally:
+            default.engine.cleanup(source_image)
+        return thumbnail
+
+
+backend = PostThumbnailBackend()
+
+
+def get_geometry(preset, width=None):
+    base_width, base_height = PRESETS[preset]['size']
+    width = width or base_width
+    return f'{width}x{round(width * base_height / base_width)}'
+
+
+def get_widths(preset, max_width=None):
+    """Ширины вариантов пресета, базовая есть всегда.
+
+    Варианты шире исходной картинки не нужны: растянутая копия
+    весит больше, а резче не становится.
+    """
+    base_width = PRESETS[preset]['size'][0]
+    return sorted({base_width} | {
+        width for width in settings.POST_IMAGE_WIDTHS
+        if max_width is None or width <= max_width
+    })
+
+
+def get_variants(max_width=None):
+    """Все миниатюры картинки: (пресет, ширина, geometry, опции)."""
+    for preset, config in PRESETS.items():
+        for width in get_widths(preset, max_width):
+            yield (preset, width, get_geometry(preset, width),
+                   config['options'])
+
+
+def source_width(image):
+    # Ширина из Post.image_width, если картинка пришла из поля поста.
+    return getattr(getattr(image, 'instance', None), 'image_width', None)
+
+
+def get_source(image):
+    """ImageFile исходной картинки.
+
+    Для имени файла sorl сам подставил бы хранилище миниатюр, а ключ
+    в kvstore зависит от хранилища, поэтому берём хранилище поля.
+    """
+    if isinstance(image, str):
+        return ImageFile(image, Post._meta.get_field('image').storage)
+    return ImageFile(image)
+
+
+def lookup(image, preset, width=None):
+    """Готовая миниатюра картинки или None, если её ещё нет."""
+    return backend.lookup(get_source(image), get_geometry(preset, width),
+                          **PRESETS[preset]['options'])
+
+
+def lookup_variants(image, preset):
+    """Готовые варианты [(ширина, миниатюра)] и признак, что каких-то
+    вариантов ещё нет."""
+    ready = []
+    widths = get_widths(preset, source_width(image))
+    for width in widths:
+        thumbnail = lookup(image, preset, width)
+        if thumbnail is not None:
+            ready.append((width, thumbnail))
+    return ready, len(ready) < len(widths)
+
+
+def render(name, force=False, max_width=None):
+    """Создаёт файлы миниатюр всех размеров без записи в kvstore.
+
+    Работает в дочерних процессах, поэтому принимает и возвращает
+    только простые значения: имя картинки, её размер и пары
+    (имя миниатюры, размер).
+    """
+    source = get_source(name)
+    thumbnails = []
+    for _, _, geometry, options in get_variants(max_width):
+        thumbnail = backend.render(source, geometry, force=force,
+                                   **options)
+        thumbnails.append((thumbnail.name, thumbnail.size))
+    return name, source.size, thumbnails
+
+
+def store(name, size, thumbnails):
+    """Записывает результат render в kvstore sorl."""
+    source = get_source(name)
+    source.set_size(size)
+    default.kvstore.get_or_set(source)
+    for thumbnail_name, thumbnail_size in thumbnails:
+        thumbnail = ImageFile(thumbnail_name, default.storage)
+        thumbnail.set_size(thumbnail_size)
+        default.kvstore.set(thumbnail, source)
+    thumbnails_ready.send(sender=None, name=name)
+
+
+def generate(image, max_width=None):
+    """Создаёт недостающие миниатюры всех размеров из PRESETS.
+
+    image - поле картинки поста или имя файла. Для имени ширину
+    исходной картинки нужно передать в max_width. Если какую-то
+    миниатюру создать не удалось, после остальных поднимается
+    ThumbnailError: задачу повторит очередь, а после последней попытки
+    она останется в таблице с пометкой failed.
+    """
+    source = get_source(image)
+    created = False
+    failed = 0
+    for preset, width, geometry, options in get_variants(
+        max_width or source_width(image)
+    ):
+        if lookup(image, preset, width) is not None:
+            continue
+        try:
+            get_thumbnail(source, geometry, **options)
+        except Exception:
+            logger.exception('Не удалось создать миниатюру %s', image)
+        # Для отсутствующего или битого файла sorl ничего
+        # не сохраняет в kvstore.
+        if lookup(image, preset, width) is None:
+            failed += 1
+        else:
+            created = True
+    if created:
+        thumbnails_ready.send(sender=None, name=str(image))
+    if failed:
+        raise ThumbnailError(f'Не удалось создать миниатюр: {failed}, '
+                             f'картинка {image}')
+    return created
+
+
+def queue(image):
+    """Ставит создание миниатюр картинки в очередь фоновых задач.
+
+    Вызывается при сохранении поста с новой картинкой; шаблоны только
+    читают готовые миниатюры. Задача выполняется после коммита
+    транзакции. Картинка, которая уже ждёт в очереди, повторно
+    не ставится.
+    """
+    if image:
+        tasks.enqueue(generate, str(image), source_width(image),
+                      key=str(image))
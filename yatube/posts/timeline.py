@@ -0,0 +1,122 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Follow, Post, TimelineEntry, UserStats
+
+BATCH_SIZE = 1000
+
+
+def is_celebrity(author_id):
+    """Авторам с огромной аудиторией ленты не раскладываются,
+    их посты подмешиваются живым запросом.
+
+    Автор, чьи посты хоть раз не разложились, помечается и остаётся
+    в живом запросе навсегда: иначе, когда подписчиков станет меньше
+    порога, эти посты пропали бы из лент.
+    """
+    stats = UserStats.objects.filter(user_id=author_id).values_list(
+        'followers_count', 'fanout_disabled'
+    ).first()
+    if stats is None:
+        return False
+    followers, disabled = stats
+    if not disabled and followers > settings.TIMELINE_FANOUT_LIMIT:
+        UserStats.objects.filter(user_id=author_id).update(
+            fanout_disabled=True
+        )
+        return True
+    return disabled
+
+
+def followed_celebrities(user):
+    return list(
+        Follow.objects.filter(
+            Q(author__stats__fanout_disabled=True)
+            | Q(author__stats__followers_count__gt=(
+                settings.TIMELINE_FANOUT_LIMIT
+            )),
+            user=user,
+        ).values_list('author', flat=True)
+    )
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def _insert_all(entries):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    _bulk_insert(batch)
+
+
+def _followers(author_id):
+    return Follow.objects.filter(author_id=author_id).values_list(
+        'user', flat=True
+    ).iterator(chunk_size=BATCH_SIZE)
+
+
+def fan_out_post(post):
+    """Кладёт новый пост в ленты всех подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    _insert_all(
+        TimelineEntry(
+            user_id=user_id,
+            post=post,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in _followers(post.author_id)
+    )
+
+
+def fan_out_posts(posts):
+    """Раскладывает по лентам посты, созданные в обход post_save:
+    подписчики каждого автора читаются один раз на все его посты."""
+    by_author = defaultdict(list)
+    for pk, author_id, pub_date in posts.values_list(
+        'pk', 'author_id', 'pub_date'
+    ).iterator(chunk_size=BATCH_SIZE):
+        by_author[author_id].append((pk, pub_date))
+    for author_id, author_posts in by_author.items():
+        if is_celebrity(author_id):
+            continue
+        _insert_all(
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in _followers(author_id)
+            for post_id, pub_date in author_posts
+        )
+
+
+def add_author(user_id, author_id):
+    """Добавляет в ленту пользователя все посты нового автора."""
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )
+    _insert_all(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            pub_date=pub_date,
+        )
+        for post_id, pub_date in posts.iterator(chunk_size=BATCH_SIZE)
+    )
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
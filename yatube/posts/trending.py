@@ -0,0 +1,121 @@
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import tasks
+
+from . import cache_versions
+from .models import Post, UserStats
+
+BATCH_SIZE = 1000
+
+
+def decay_factor(seconds):
+    return 0.5 ** (max(seconds, 0) / settings.TRENDING_HALF_LIFE)
+
+
+def decayed(score, since, now):
+    """Счёт, посчитанный на момент since, пересчитанный на now."""
+    if since is None or not score:
+        return score
+    score *= decay_factor((now - since).total_seconds())
+    return score if score >= settings.TRENDING_MIN_SCORE else 0
+
+
+def schedule_decay():
+    # Пока задача ждёт, key не даёт поставить вторую такую же. Посты,
+    # счёт которых менялся после прошлого остывания, посчитаны на разные
+    # моменты; задача выравнивает их не позже чем через интервал
+    # и ставит следующую, пока в «Популярном» остаются посты.
+    tasks.enqueue(decay, key='trending', priority=tasks.PRIORITY_LOW,
+                  delay=settings.TRENDING_DECAY_INTERVAL)
+
+
+def add(post_id, delta, now=None):
+    """Сдвигает счёт поста на delta, сначала остудив его до now.
+
+    Строка поста блокируется, чтобы одновременные комментарии
+    и задача остывания не затирали изменения друг друга.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        row = Post.objects.select_for_update().filter(
+            pk=post_id
+        ).values_list('trending_score', 'trending_at').first()
+        if row is None:
+            return
+        score = max(decayed(*row, now) + delta, 0)
+        if score < settings.TRENDING_MIN_SCORE:
+            score = 0
+        # update() не трогает Post.updated: карточки в кэше остаются.
+        Post.objects.filter(pk=post_id).update(trending_score=score,
+                                               trending_at=now)
+    if score:
+        schedule_decay()
+
+
+def post_created(post):
+    """Начальный счёт поста - охват: чем больше у автора подписчиков,
+    тем больше людей увидит пост в первые часы."""
+    followers = UserStats.objects.filter(user_id=post.author_id).values_list(
+        'followers_count', flat=True
+    ).first() or 0
+    if followers:
+        add(post.pk, settings.TRENDING_REACH_WEIGHT * math.log1p(followers))
+
+
+def comment_added(comment):
+    add(comment.post_id, settings.TRENDING_COMMENT_WEIGHT)
+
+
+def comment_removed(comment):
+    # Вычитается то, что осталось от вклада комментария к этому моменту.
+    now = timezone.now()
+    add(comment.post_id, -settings.TRENDING_COMMENT_WEIGHT * decay_factor(
+        (now - comment.created).total_seconds()
+    ), now)
+
+
+def decay(batch_size=BATCH_SIZE):
+    """Записывает остывание всех постов в «Популярном» на текущий момент.
+
+    Читаются только посты с ненулевым счётом, остывшие до
+    TRENDING_MIN_SCORE обнуляются. Пока в ленте остаются посты, ставит
+    следующее остывание. Возвращает (остужено, выпало из ленты).
+    """
+    now = timezone.now()
+    updated = dropped = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Post.objects.select_for_update().filter(
+                    trending_score__gt=0, pk__gt=last_pk
+                ).order_by('pk').values_list(
+                    'pk', 'trending_score', 'trending_at'
+                )[:batch_size]
+            )
+            if not rows:
+                break
+            posts = []
+            for pk, score, since in rows:
+                score = decayed(score, since, now)
+                dropped += not score
+                posts.append(Post(pk=pk, trending_score=score,
+                                  trending_at=now))
+            Post.objects.bulk_update(posts, ['trending_score', 'trending_at'])
+        updated += len(rows)
+        last_pk = rows[-1][0]
+    cache_versions.bump('trending')
+    if updated > dropped:
+        schedule_decay()
+    return updated, dropped
+
+
+def top():
+    """Лента «Популярное»: один проход по индексу post_trending_idx."""
+    return Post.objects.filter(trending_score__gt=0).select_related(
+        'author__stats', 'group'
+    ).order_by('-trending_score', '-id')[:settings.TRENDING_SIZE]
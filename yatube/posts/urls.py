@@ -6,8 +6,20 @@ app_name = 'posts'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('trending/', views.trending, name='trending'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('tag/<str:name>/', views.tag_posts, name='tag_posts'),
+    path('profile/<str:username>/mentions/', views.mention_posts,
+         name='mention_posts'),
+    path('search/', views.search_posts, name='search'),
+    path('autocomplete/', views.autocomplete_view, name='autocomplete'),
+    path('export.<str:export_format>', views.site_export,
+         name='site_export'),
+    path('group/<slug:slug>/export.<str:export_format>',
+         views.group_export, name='group_export'),
+    path('profile/<str:username>/export.<str:export_format>',
+         views.profile_export, name='profile_export'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<post_id>/edit/', views.post_edit, name='post_edit'),
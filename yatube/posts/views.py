@@ -1,70 +1,248 @@
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from .autocomplete import autocomplete
+from .cache_versions import conditional, fragment_context
+from .exports import export_response
+from .counters import get_stats
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Follow, Group, Post, Tag, TimelineEntry, User
+from .paginator import CursorPaginator
+from .related import related_posts
+from .search import SearchPaginator, build_query, search
+from .timeline import followed_celebrities
+from .trending import top
 
 
-def get_paginator_obj(request, query_list):
+def get_paginator_obj(request, query_list,
+                      date_field='pub_date', id_field='pk'):
+    cursor = request.GET.get('cursor')
+    use_cursor = cursor is not None or (
+        settings.PAGINATION_MODE == 'cursor' and 'page' not in request.GET
+    )
+    if use_cursor:
+        paginator = CursorPaginator(query_list, settings.COUNT_PAGE,
+                                    date_field=date_field, id_field=id_field)
+        return paginator.get_page(cursor)
     paginator = Paginator(query_list, settings.COUNT_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
 
 
+def index_scopes(request):
+    return ['posts']
+
+
+def trending_scopes(request):
+    return ['posts', 'trending']
+
+
+def group_scopes(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    return None if group_id is None else [f'group:{group_id}']
+
+
+def tag_scopes(request, name):
+    # Лента тега меняется с любым постом: новые теги, правка текста.
+    exists = Tag.objects.filter(kind=Tag.HASHTAG,
+                                name=name.casefold()).exists()
+    return ['posts'] if exists else None
+
+
+def mention_scopes(request, username):
+    exists = User.objects.filter(username=username).exists()
+    return ['posts'] if exists else None
+
+
+def profile_scopes(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    scopes = [f'profile:{author_id}']
+    if request.user.is_authenticated:
+        scopes.append(f'follow:{request.user.pk}')
+    return scopes
+
+
+def post_scopes(request, post_id):
+    post = Post.objects.filter(pk=post_id).values(
+        'author_id', 'group_id'
+    ).first()
+    if post is None:
+        return None
+    scopes = [f'post:{post_id}', f'profile:{post["author_id"]}']
+    if post['group_id']:
+        scopes.append(f'group:{post["group_id"]}')
+    return scopes
+
+
+def follow_scopes(request):
+    return ['posts', f'follow:{request.user.pk}']
+
+
+@conditional(index_scopes)
 def index(request):
     templates = 'posts/index.html'
-    post_list = Post.objects.all()
+    post_list = Post.objects.select_related('author__stats', 'group')
     page_obj = get_paginator_obj(request, post_list)
     context = {
         'page_obj': page_obj,
+        **fragment_context('posts'),
     }
     return render(request, templates, context)
 
 
+@conditional(trending_scopes)
+def trending(request):
+    context = {
+        'page_obj': top(),
+        **fragment_context('posts', 'trending'),
+    }
+    return render(request, 'posts/trending.html', context)
+
+
+@conditional(group_scopes)
 def group_posts(request, slug):
     templates = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts_list = group.group_posts.all()
+    posts_list = group.group_posts.select_related('author__stats', 'group')
     page_obj = get_paginator_obj(request, posts_list)
     context = {
         'group': group,
         'page_obj': page_obj,
+        **fragment_context(f'group:{group.pk}'),
     }
     return render(request, templates, context)
 
 
+def tag_feed(request, tag):
+    if tag is None:
+        return get_paginator_obj(request, Post.objects.none())
+    post_list = Post.objects.filter(
+        tag_links__tag=tag
+    ).select_related('author__stats', 'group').order_by(
+        F('tag_links__pub_date').desc(),
+        F('tag_links__post_id').desc()
+    )
+    return get_paginator_obj(
+        request,
+        post_list,
+        date_field='tag_links__pub_date',
+        id_field='tag_links__post_id'
+    )
+
+
+@conditional(tag_scopes)
+def tag_posts(request, name):
+    tag = get_object_or_404(Tag, kind=Tag.HASHTAG, name=name.casefold())
+    context = {
+        'tag': tag,
+        'page_obj': tag_feed(request, tag),
+        **fragment_context('posts'),
+    }
+    return render(request, 'posts/tag_list.html', context)
+
+
+@conditional(mention_scopes)
+def mention_posts(request, username):
+    author = get_object_or_404(User, username=username)
+    tag = Tag.objects.filter(kind=Tag.MENTION, name=username).first()
+    context = {
+        'tag': tag,
+        'client': author,
+        'page_obj': tag_feed(request, tag),
+        **fragment_context('posts'),
+    }
+    return render(request, 'posts/tag_list.html', context)
+
+
+@conditional(profile_scopes)
 def profile(request, username):
     user = request.user
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
     following = (user.is_authenticated
                  and Follow.objects.filter(user=user, author=author).exists())
-    post_list = Post.objects.filter(author__username=username)
-    count_posts = post_list.count()
+    post_list = author.posts.select_related('author__stats', 'group')
+    stats = get_stats(author)
     page_obj = get_paginator_obj(request, post_list)
-    client = get_object_or_404(User, username=username)
     context = {
-        'client': client,
-        'count_posts': count_posts,
+        'client': author,
+        'count_posts': stats.posts_count,
+        'stats': stats,
         'page_obj': page_obj,
-        'following': following
+        'following': following,
+        **fragment_context(f'profile:{author.pk}'),
     }
     return render(request, 'posts/profile.html', context)
 
 
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    # Запрос из одних знаков препинания - всё равно что пустой.
+    if build_query(query) is not None:
+        results = search(query).select_related('author__stats', 'group')
+        paginator = SearchPaginator(results, settings.COUNT_PAGE)
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def autocomplete_view(request):
+    try:
+        limit = max(int(request.GET.get('limit', 0)), 0)
+    except ValueError:
+        limit = 0
+    results = autocomplete.lookup(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': results})
+
+
+def profile_export(request, username, export_format):
+    author = get_object_or_404(User, username=username)
+    return export_response(author.posts.all(), export_format,
+                           f'posts-{author.username}')
+
+
+def group_export(request, slug, export_format):
+    group = get_object_or_404(Group, slug=slug)
+    return export_response(group.group_posts.all(), export_format,
+                           f'posts-{group.slug}')
+
+
+@staff_member_required
+def site_export(request, export_format):
+    return export_response(Post.objects.all(), export_format, 'posts')
+
+
+@conditional(post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    post_list = Post.objects.filter(author__username=post.author)
-    count_posts = post_list.count()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id
+    )
     comment_form = CommentForm()
     comment_list = post.comments.all()
     context = {
         'post': post,
-        'count_posts': count_posts,
+        'count_posts': get_stats(post.author).posts_count,
         'comment_form': comment_form,
-        'comments': comment_list
+        'comments': comment_list,
+        'related_posts': related_posts(post),
     }
     return render(request, 'posts/post_detail.html', context)
 
@@ -79,7 +257,9 @@ def post_create(request):
     if form.is_valid():
         post = form.save(commit=False)
         post.author = client
-        post.save()
+        # Счётчики обновляет post_save: в одной транзакции с постом.
+        with transaction.atomic():
+            post.save()
         return redirect('posts:profile', username=post.author.username)
     return render(request, template, {'form': form})
 
@@ -97,7 +277,8 @@ def post_edit(request, post_id):
         files=request.FILES or None
     )
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            form.save()
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
@@ -115,18 +296,39 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
+@conditional(follow_scopes)
 def follow_index(request):
     template = 'posts/follow.html'
     user = request.user
-    post_list = Post.objects.filter(author__following__user=user)
-    page_obj = get_paginator_obj(request, post_list)
+    celebrities = followed_celebrities(user)
+    if celebrities:
+        timeline = TimelineEntry.objects.filter(user=user).values('post')
+        post_list = Post.objects.filter(
+            Q(pk__in=timeline) | Q(author__in=celebrities)
+        ).select_related('author__stats', 'group')
+        page_obj = get_paginator_obj(request, post_list)
+    else:
+        post_list = Post.objects.filter(
+            timeline_entries__user=user
+        ).select_related('author__stats', 'group').order_by(
+            F('timeline_entries__pub_date').desc(),
+            F('timeline_entries__post_id').desc()
+        )
+        page_obj = get_paginator_obj(
+            request,
+            post_list,
+            date_field='timeline_entries__pub_date',
+            id_field='timeline_entries__post_id'
+        )
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        **fragment_context('posts', f'follow:{user.pk}'),
     }
     return render(request, template, context)
 
@@ -135,6 +337,8 @@ def follow_index(request):
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
+        # get_or_create и delete сами создают транзакцию, сигналы
+        # со счётчиками выполняются внутри неё.
         Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('posts:profile', username=username)
 
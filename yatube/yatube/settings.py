@@ -1,4 +1,5 @@
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -12,6 +13,9 @@ SECRET_KEY = '6&$v99bnxsmkvq_3=+gte3&$m$m*v(*il=1uf#6@bau26&fl+r'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = False
 
+# Запуск тестов: manage.py test или pytest.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
@@ -120,22 +124,134 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+# Письма не отправляются в запросе, а складываются в core.OutboxMessage.
+# Доставляет их фоновая задача или команда send_outbox через
+# OUTBOX_EMAIL_BACKEND, одним соединением на порцию писем.
+EMAIL_BACKEND = 'core.mail.OutboxBackend'
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+# Пауза перед повторной отправкой в секундах, удваивается с каждой
+# попыткой.
+OUTBOX_RETRY_DELAY = 60
 
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 COUNT_PAGE = 10
 
+# 'offset' - нумерованные страницы, 'cursor' - переход по курсору
+# без COUNT(*) и OFFSET. Ссылки вида ?page=N работают в обоих режимах.
+PAGINATION_MODE = 'offset'
+
+# Посты авторов, у которых подписчиков больше этого числа, не раскладываются
+# по лентам подписчиков, а подмешиваются в ленту живым запросом. Автор
+# остаётся в живом запросе и после того, как подписчиков стало меньше.
+TIMELINE_FANOUT_LIMIT = 1000
+
+# Лента «Популярное»: счёт поста растёт на TRENDING_COMMENT_WEIGHT
+# с каждым комментарием, при публикации получает TRENDING_REACH_WEIGHT
+# * ln(1 + подписчики автора) и вдвое остывает за TRENDING_HALF_LIFE
+# секунд. Остывание записывается в базу задачей раз в
+# TRENDING_DECAY_INTERVAL секунд, пока в ленте есть посты; счёт ниже
+# TRENDING_MIN_SCORE обнуляется, и пост выпадает из ленты.
+TRENDING_COMMENT_WEIGHT = 1.0
+TRENDING_REACH_WEIGHT = 0.5
+TRENDING_HALF_LIFE = 6 * 60 * 60
+TRENDING_DECAY_INTERVAL = 10 * 60
+TRENDING_MIN_SCORE = 0.05
+TRENDING_SIZE = 20
+
+# Похожие посты: до RELATED_POSTS_COUNT соседей с косинусом TF-IDF
+# не меньше RELATED_MIN_SCORE. Слова, которые есть в большей чем
+# RELATED_MAX_DF доле постов, не учитываются. build_related_posts
+# перемножает матрицы по RELATED_BLOCK_SIZE строк, с --loop
+# повторяет пересчёт каждые RELATED_UPDATE_INTERVAL секунд.
+RELATED_POSTS_COUNT = 5
+RELATED_MIN_SCORE = 0.1
+RELATED_MAX_DF = 0.5
+RELATED_BLOCK_SIZE = 256
+RELATED_UPDATE_INTERVAL = 5 * 60
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки называются по хешу содержимого и раскладываются
+# по подкаталогам. Миниатюры sorl называет сам, им нужно обычное
+# хранилище, которое сохраняет файл под переданным именем.
+DEFAULT_FILE_STORAGE = 'core.storage.HashedFileSystemStorage'
+THUMBNAIL_STORAGE = 'django.core.files.storage.FileSystemStorage'
+
+# Загрузки отдаёт core.views.media. Если перед приложением стоит nginx
+# или Apache, файл можно отдать им: 'X-Accel-Redirect' с internal-location
+# MEDIA_ACCEL_PREFIX, указывающим на MEDIA_ROOT, или 'X-Sendfile'.
+MEDIA_SENDFILE_HEADER = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Фоновые задачи core.tasks: миниатюры, письма. Сразу после коммита
+# задачу подхватывает пул из TASK_WORKERS потоков процесса, 0 - она
+# выполняется в текущем потоке. Запрос выполнения задач не ждёт. Если в
+# очереди пула уже TASK_LOCAL_BACKLOG задач, новые остаются в таблице.
+# Повторы после ошибок, задачи, которые процесс не взял или не успел
+# выполнить, берёт команда run_tasks. При TASK_RUN_LOCALLY = False все
+# задачи выполняет только она.
+# В тестах задачи выполняются сразу: фоновый поток пережил бы тест
+# и писал бы во временный MEDIA_ROOT, который тест уже удалил.
+TASK_WORKERS = 0 if TESTING else 2
+TASK_LOCAL_BACKLOG = 20
+TASK_RUN_LOCALLY = True
+TASK_MAX_ATTEMPTS = 3
+# Пауза перед повтором в секундах, удваивается с каждой попыткой.
+TASK_RETRY_DELAY = 30
+# Через столько секунд задача упавшего воркера снова станет готовой.
+TASK_LOCK_TIMEOUT = 10 * 60
+
+# До готовности миниатюр шаблоны показывают заглушку.
+# Ширины вариантов миниатюр для srcset, базовая ширина шаблона
+# добавляется к ним всегда.
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+
+# Загруженные картинки уменьшаются до этой длины большей стороны,
+# очищаются от метаданных и пересохраняются в 'JPEG' или 'WEBP'.
+POST_IMAGE_MAX_SIDE = 1920
+POST_IMAGE_FORMAT = 'JPEG'
+POST_IMAGE_QUALITY = 85
+
+# Подсказки /autocomplete/ отдаются из индекса в памяти процесса.
+# Не больше AUTOCOMPLETE_LIMIT самых популярных; популярность
+# пересчитывается полной перестройкой индекса раз в столько секунд.
+# Изменения других процессов приходят через журнал в кэше; процесс,
+# отставший больше чем на AUTOCOMPLETE_LOG_SIZE записей, перестраивает
+# индекс целиком.
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_REBUILD_INTERVAL = 15 * 60
+AUTOCOMPLETE_LOG_SIZE = 1000
+
+# Общий для всех процессов кэш в файле SQLite: версии фрагментов
+# и ETag сбрасываются сразу во всех воркерах.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
+# Тесты чистят кэш в setUp: у них свой кэш в памяти, чтобы не стирать
+# общий файл запущенного рядом сайта.
+if TESTING:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+
+# Фрагменты лент сбрасываются по событиям через версии в ключах,
+# таймаут лишь вычищает ключи устаревших версий.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
 
 INTERNAL_IPS = [
     '127.0.0.1',